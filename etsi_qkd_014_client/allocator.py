@@ -0,0 +1,370 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Key material allocators serving sub-keys of arbitrary sizes from large keys.
+
+On the master side, the KeyAllocator requests keys of the maximum size allowed
+by the KME and slices them into sub-keys. Each sub-key is described by the ID
+of the key it was taken from, its offset and its size in bits, that are sent to
+the slave SAE.
+
+On the slave side, the KeySliceResolver gets the keys with their IDs once and
+derives the same sub-keys from these descriptions.
+"""
+
+import base64
+import collections
+import threading
+from typing import Tuple
+
+from .client import QKD014Client
+from .data import QKD014Data
+
+
+def extract_bits(data: bytes, offset: int, size: int) -> bytes:
+    """Extract a slice of bits from a key.
+
+    The bits are counted from the most significant bit of the first byte. If the
+    size is not a multiple of 8, the last byte is padded with zeros on the right.
+
+    Args:
+        data (bytes): the key.
+        offset (int): offset of the slice, in bits.
+        size (int): size of the slice, in bits.
+
+    Raises:
+        Exception: if the slice is not included in the key.
+
+    Returns:
+        bytes: the slice.
+    """
+    total = len(data) * 8
+    if offset < 0 or size <= 0 or offset + size > total:
+        raise Exception(
+            f"Cannot extract {size} bits at offset {offset} from a key of {total} bits."
+        )
+
+    if offset % 8 == 0 and size % 8 == 0:
+        return data[offset // 8 : (offset + size) // 8]
+
+    value = int.from_bytes(data, "big")
+    value = (value >> (total - offset - size)) & ((1 << size) - 1)
+    padding = -size % 8
+    return (value << padding).to_bytes((size + padding) // 8, "big")
+
+
+class KeySlice(QKD014Data):
+    """
+    Sub-key taken from a key delivered by the KME.
+
+    The key_id, offset and size attributes are the description of the sub-key
+    that should be sent to the slave SAE.
+    """
+
+    key_id: str  #: ID of the key the sub-key was taken from.
+    offset: int  #: Offset of the sub-key in the key, in bits.
+    size: int  #: Size of the sub-key, in bits.
+    key: bytes  #: The sub-key. If size is not a multiple of 8, the last byte is padded with zeros on the right.
+
+    def __init__(self, key_id: str, offset: int, size: int, key: bytes) -> None:
+        """Init the instance.
+
+        Args:
+            key_id (str): ID of the key the sub-key was taken from.
+            offset (int): offset of the sub-key in the key, in bits.
+            size (int): size of the sub-key, in bits.
+            key (bytes): the sub-key.
+        """
+        self.key_id = key_id
+        self.offset = offset
+        self.size = size
+        self.key = key
+
+    def __str__(self) -> str:
+        """String representation of the instance.
+
+        Returns:
+            str: String representation of the instance.
+        """
+        res = ""
+        res += f"Key id : {self.key_id}\n"
+        res += f"Offset : {self.offset}\n"
+        res += f"Size : {self.size}\n"
+        res += f"Key : {base64.b64encode(self.key).decode('ascii')}\n"
+        return res
+
+
+class KeyAllocator:
+    """
+    Master side allocator of sub-keys.
+
+    Keys are requested in bulk to the KME, with the maximum size it allows, and
+    sub-keys are allocated contiguously in each key. The number of bits used in
+    each key is tracked, and a key is never used twice. Keys are forgotten as soon
+    as they are used up.
+    """
+
+    def __init__(
+        self,
+        client: QKD014Client,
+        slave_sae_id: str,
+        key_size: int = None,
+        number: int = None,
+    ) -> None:
+        """Init the allocator.
+
+        Args:
+            client (QKD014Client): client used to get the keys from the KME.
+            slave_sae_id (str): ID of the slave SAE.
+            key_size (int, optional): size of the keys requested to the KME in bits, if None is given, max_key_size of the status of the KME is used. Defaults to None.
+            number (int, optional): number of keys requested to the KME at once, if None is given, max_key_per_request of the status of the KME is used. Defaults to None.
+        """
+        self.client = client
+        self.slave_sae_id = slave_sae_id
+        self.key_size = key_size
+        self.number = number
+
+        self._keys = collections.deque()
+        self._used = {}
+        self._lock = threading.Lock()
+
+    def _configure(self) -> Tuple[int, QKD014Data]:
+        """Get the key size and the number of keys per request from the status of the KME if needed.
+
+        Returns:
+            (int, QKD014Data): The response code and DataStatus or DataError, or (200, None) if the status was not needed.
+        """
+        if self.key_size is not None and self.number is not None:
+            return 200, None
+
+        code, status = self.client.get_status(self.slave_sae_id)
+        if code != 200:
+            return code, status
+
+        if self.key_size is None:
+            self.key_size = status.max_key_size
+        if self.number is None:
+            self.number = status.max_key_per_request
+        return code, status
+
+    def _fill(self) -> Tuple[int, QKD014Data]:
+        """Get a new batch of keys from the KME.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        code, data = self._configure()
+        if code != 200:
+            return code, data
+
+        code, data = self.client.get_key(
+            self.slave_sae_id, number=self.number, size=self.key_size
+        )
+        if code != 200:
+            return code, data
+
+        for key in data.keys:
+            self._keys.append((key.key_id, base64.b64decode(key.key)))
+            self._used[key.key_id] = 0
+        return code, data
+
+    def allocate(self, size: int) -> Tuple[int, QKD014Data]:
+        """Allocate a sub-key.
+
+        Args:
+            size (int): size of the sub-key, in bits.
+
+        Raises:
+            Exception: if the size is larger than the size of the keys.
+
+        Returns:
+            (int, QKD014Data): The response code and KeySlice, or DataError if keys could not be obtained from the KME.
+        """
+        with self._lock:
+            if self.key_size is not None and size > self.key_size:
+                raise Exception(
+                    f"Cannot allocate {size} bits from keys of {self.key_size} bits."
+                )
+
+            while self._keys:
+                key_id, key = self._keys[0]
+                offset = self._used[key_id]
+                if offset + size <= len(key) * 8:
+                    break
+                # Not enough bits left in this key, the remaining bits are discarded.
+                self._keys.popleft()
+                del self._used[key_id]
+            else:
+                code, data = self._fill()
+                if code != 200:
+                    return code, data
+                if size > self.key_size:
+                    raise Exception(
+                        f"Cannot allocate {size} bits from keys of {self.key_size} bits."
+                    )
+                key_id, key = self._keys[0]
+                offset = 0
+
+            key_slice = KeySlice(key_id, offset, size, extract_bits(key, offset, size))
+            if offset + size == len(key) * 8:
+                self._keys.popleft()
+                del self._used[key_id]
+            else:
+                self._used[key_id] = offset + size
+            return 200, key_slice
+
+    def used_bits(self, key_id: str) -> int:
+        """Get the number of bits already used in a key.
+
+        Args:
+            key_id (str): ID of the key.
+
+        Returns:
+            int: the number of used bits, the bits from 0 to this number being used. Keys that were used up are forgotten, and 0 is returned for them.
+        """
+        with self._lock:
+            return self._used.get(key_id, 0)
+
+
+class KeySliceResolver:
+    """
+    Slave side resolver of the sub-keys allocated by a KeyAllocator.
+
+    Keys are obtained once from the KME with their IDs and the sub-keys are
+    derived locally. The portions of each key that were already derived are
+    tracked, and deriving a portion twice is refused.
+
+    The sub-keys must be resolved in the order they were allocated. Since the
+    allocator uses its keys one after the other, the previous key is forgotten as
+    soon as a sub-key of a new key is resolved: the bits left in it were discarded
+    by the allocator. A key is also forgotten once all its bits were derived, or
+    when it is released. Since the KME delivers a key only once, the sub-keys of a
+    forgotten key cannot be derived again.
+    """
+
+    def __init__(self, client: QKD014Client, master_sae_id: str) -> None:
+        """Init the resolver.
+
+        Args:
+            client (QKD014Client): client used to get the keys from the KME.
+            master_sae_id (str): ID of the master SAE.
+        """
+        self.client = client
+        self.master_sae_id = master_sae_id
+
+        self._keys = {}
+        self._used = collections.defaultdict(list)
+        self._current = None
+        self._lock = threading.Lock()
+
+    def prefetch(self, key_ids: list[str]) -> Tuple[int, QKD014Data]:
+        """Get keys from the KME with their IDs, in a single request.
+
+        Args:
+            key_ids (list[str]): IDs of the keys.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError, or (200, None) if all the keys were already known.
+        """
+        with self._lock:
+            missing = [key_id for key_id in key_ids if key_id not in self._keys]
+        if not missing:
+            return 200, None
+
+        code, data = self.client.get_key_with_key_IDs(self.master_sae_id, missing)
+        if code != 200:
+            return code, data
+
+        with self._lock:
+            for key in data.keys:
+                self._keys[key.key_id] = base64.b64decode(key.key)
+        return code, data
+
+    def resolve(self, key_id: str, offset: int, size: int) -> Tuple[int, QKD014Data]:
+        """Derive a sub-key from its description.
+
+        Args:
+            key_id (str): ID of the key the sub-key was taken from.
+            offset (int): offset of the sub-key in the key, in bits.
+            size (int): size of the sub-key, in bits.
+
+        Raises:
+            Exception: if a portion of the sub-key was already derived, or if the key was released meanwhile.
+
+        Returns:
+            (int, QKD014Data): The response code and KeySlice, or DataError if the key could not be obtained from the KME.
+        """
+        code, data = self.prefetch([key_id])
+        if code != 200:
+            return code, data
+
+        with self._lock:
+            for used_offset, used_size in self._used[key_id]:
+                if offset < used_offset + used_size and used_offset < offset + size:
+                    raise Exception(
+                        f"Bits {offset} to {offset + size} of key {key_id} overlap an already used portion."
+                    )
+            key_bytes = self._keys.get(key_id)
+            if key_bytes is None:
+                raise Exception(f"Key {key_id} was released.")
+            if key_id != self._current:
+                # The allocator discarded the bits left in the previous key.
+                if self._current is not None:
+                    self._forget(self._current)
+                self._current = key_id
+            key = extract_bits(key_bytes, offset, size)
+            self._used[key_id].append((offset, size))
+            if (
+                sum(used_size for _, used_size in self._used[key_id])
+                == len(key_bytes) * 8
+            ):
+                self._forget(key_id)
+        return 200, KeySlice(key_id, offset, size, key)
+
+    def _forget(self, key_id: str) -> None:
+        """Remove a key and its derived portions. The lock must be held.
+
+        Args:
+            key_id (str): ID of the key.
+        """
+        self._keys.pop(key_id, None)
+        self._used.pop(key_id, None)
+
+    def release(self, key_id: str) -> None:
+        """Forget a key that will not be used anymore.
+
+        The keys are already forgotten when used up or when a sub-key of the next
+        key is resolved, so this is only needed for keys that were prefetched and
+        will not be used.
+
+        Args:
+            key_id (str): ID of the key.
+        """
+        with self._lock:
+            self._forget(key_id)
+
+    def used_portions(self, key_id: str) -> list[Tuple[int, int]]:
+        """Get the portions of a key that were already derived.
+
+        Args:
+            key_id (str): ID of the key.
+
+        Returns:
+            list[Tuple[int, int]]: list of (offset, size) of the derived portions, in bits. The list is empty for the keys that were forgotten.
+        """
+        with self._lock:
+            return list(self._used.get(key_id, []))
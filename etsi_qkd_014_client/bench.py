@@ -0,0 +1,200 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Load generation against a KME, used by the bench command of the command line interface.
+"""
+
+import collections
+import cProfile
+import pstats
+import sys
+import threading
+import time
+from typing import Callable, Tuple
+
+from .data import DataKeyContainer, QKD014Data
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Get a percentile of sorted values, with the nearest rank method.
+
+    Args:
+        values (list[float]): sorted values.
+        fraction (float): the percentile, between 0 and 1.
+
+    Returns:
+        float: the percentile, or None if there is no value.
+    """
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, int(fraction * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+class BenchResult:
+    """
+    Result of a load generation run.
+    """
+
+    duration: float  #: Actual duration of the run, in seconds.
+    latencies: list[float]  #: Sorted latencies, from the scheduled start, in seconds.
+    service_times: list[float]  #: Sorted service times of the requests, in seconds.
+    codes: collections.Counter  #: Number of responses for each response code.
+    exceptions: collections.Counter  #: Number of exceptions for each type.
+    keys: int  #: Number of keys received.
+    stats: pstats.Stats  #: Profiling statistics, if profiling was enabled.
+
+    def __init__(self) -> None:
+        """Init the instance."""
+        self.duration = 0
+        self.latencies = []
+        self.service_times = []
+        self.codes = collections.Counter()
+        self.exceptions = collections.Counter()
+        self.keys = 0
+        self.stats = None
+
+    def __str__(self) -> str:
+        """String representation of the instance.
+
+        Returns:
+            str: String representation of the instance.
+        """
+        requests_count = len(self.latencies)
+        res = f"Duration : {self.duration:.3f} s\n"
+        res += f"Requests : {requests_count} ({requests_count / self.duration:.1f} req/s)\n"
+        res += f"Keys : {self.keys} ({self.keys / self.duration:.1f} keys/s)\n"
+        for title, values in (
+            ("Latency", self.latencies),
+            ("Service time", self.service_times),
+        ):
+            if not values:
+                continue
+            res += f"{title} :\n"
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                res += f"\t {name} : {percentile(values, fraction) * 1e3:.3f} ms\n"
+            res += f"\t max : {values[-1] * 1e3:.3f} ms\n"
+        res += "Response codes :\n"
+        for code, count in sorted(self.codes.items()):
+            res += f"\t {code} : {count}\n"
+        for name, count in sorted(self.exceptions.items()):
+            res += f"\t {name} : {count}\n"
+        return res
+
+
+def run_bench(
+    call: Callable[[], Tuple[int, QKD014Data]],
+    duration: float,
+    concurrency: int = 1,
+    rate: float = None,
+    profile: bool = False,
+) -> BenchResult:
+    """Call a command repeatedly for a given duration and measure the results.
+
+    The latency of each request is measured from the time at which it was
+    scheduled, so that the time spent waiting for a worker when the KME falls
+    behind the target rate is accounted for. The service time is measured from
+    the time at which the request was actually made.
+
+    Args:
+        call (Callable[[], Tuple[int, QKD014Data]]): the command to call, returning the response code and data.
+        duration (float): duration of the run, in seconds.
+        concurrency (int, optional): number of concurrent requests. Defaults to 1.
+        rate (float, optional): target number of requests per second, shared by all the workers. If None is given, the requests are made as fast as possible. Defaults to None.
+        profile (bool, optional): if true, the workers are profiled with cProfile. Since Python 3.12, only one profiler can be active at a time, so the whole process is profiled during the run instead. Defaults to False.
+
+    Returns:
+        BenchResult: the result of the run.
+    """
+    result = BenchResult()
+    lock = threading.Lock()
+    profilers = []
+    per_thread_profile = profile and sys.version_info < (3, 12)
+    process_profiler = None
+    if profile and not per_thread_profile:
+        process_profiler = cProfile.Profile()
+        process_profiler.enable()
+    start = time.perf_counter()
+    end = start + duration
+    sent = 0
+
+    def next_slot() -> float:
+        """Get the time at which the next request should be sent.
+
+        Returns:
+            float: the time, or None if the run is over.
+        """
+        nonlocal sent
+        with lock:
+            slot = start + sent / rate if rate else time.perf_counter()
+            sent += 1
+        return slot if slot < end else None
+
+    def worker() -> None:
+        """Make requests until the end of the run."""
+        profiler = cProfile.Profile() if per_thread_profile else None
+        while True:
+            slot = next_slot()
+            if slot is None:
+                break
+            delay = slot - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            if profiler is not None:
+                profiler.enable()
+            request_start = time.perf_counter()
+            try:
+                code, data = call()
+            except Exception as exc:  # pylint: disable=broad-except
+                request_end = time.perf_counter()
+                with lock:
+                    result.latencies.append(request_end - slot)
+                    result.service_times.append(request_end - request_start)
+                    result.exceptions[type(exc).__name__] += 1
+                continue
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+            request_end = time.perf_counter()
+
+            with lock:
+                result.latencies.append(request_end - slot)
+                result.service_times.append(request_end - request_start)
+                result.codes[code] += 1
+                if code == 200 and isinstance(data, DataKeyContainer):
+                    result.keys += len(data.keys)
+
+        if profiler is not None:
+            with lock:
+                profilers.append(profiler)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if process_profiler is not None:
+        process_profiler.disable()
+        profilers.append(process_profiler)
+
+    result.duration = time.perf_counter() - start
+    result.latencies.sort()
+    result.service_times.sort()
+    if profilers:
+        result.stats = pstats.Stats(*profilers)
+    return result
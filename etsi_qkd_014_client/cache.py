@@ -0,0 +1,130 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Short-lived cache of the error responses of the KME.
+
+Errors such as 400 (bad request format) and 401 (unauthorized) come from the
+configuration of the SAE or from the request itself, and will be returned again
+for the same request. They are kept in memory for a short time, so that repeated
+requests fail immediately without reaching the KME. Errors on the server side
+(503) are transient and are never cached by default.
+"""
+
+import collections
+import json
+import threading
+import time
+from typing import Tuple
+
+from .data import DataError
+
+
+class ErrorCache:
+    """
+    Cache of the error responses, keyed by KME, command, SAE ID and request data.
+
+    A cache can be shared by clients of different KMEs.
+    """
+
+    def __init__(
+        self, ttl: float = 5, codes: Tuple[int, ...] = (400, 401), max_size: int = 1024
+    ) -> None:
+        """Init the cache.
+
+        Args:
+            ttl (float, optional): time during which an error is kept, in seconds. Defaults to 5.
+            codes (Tuple[int, ...], optional): response codes of the errors to cache. Defaults to (400, 401).
+            max_size (int, optional): maximum number of errors to keep, the oldest ones being removed first. Defaults to 1024.
+        """
+        self.ttl = ttl
+        self.codes = codes
+        self.max_size = max_size
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        kme_hostname: str, command: str, sae_id: str, data: dict = None
+    ) -> Tuple:
+        """Build the key of a request.
+
+        Args:
+            kme_hostname (str): hostname or IP address of the KME.
+            command (str): name of the command.
+            sae_id (str): SAE ID given to the command.
+            data (dict, optional): data of the request, if any. Defaults to None.
+
+        Returns:
+            Tuple: the key.
+        """
+        if data is None:
+            return (kme_hostname, command, sae_id, None)
+        return (kme_hostname, command, sae_id, json.dumps(data, sort_keys=True))
+
+    def get(self, key: Tuple) -> Tuple[int, DataError]:
+        """Get the cached error of a request.
+
+        Args:
+            key (Tuple): key of the request.
+
+        Returns:
+            (int, DataError): the response code and the error, or None if no valid error is cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expiry, code, data = entry
+            if expiry <= time.monotonic():
+                del self._entries[key]
+                return None
+            return code, data
+
+    def put(self, key: Tuple, code: int, data: DataError) -> None:
+        """Cache the error of a request, if its response code is one of the cached codes.
+
+        Args:
+            key (Tuple): key of the request.
+            code (int): response code.
+            data (DataError): the error.
+        """
+        if code not in self.codes:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, code, data)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, sae_id: str = None, kme_hostname: str = None) -> None:
+        """Remove the cached errors.
+
+        Args:
+            sae_id (str, optional): if given, only the errors of the requests with this SAE ID are removed. Defaults to None.
+            kme_hostname (str, optional): if given, only the errors of the requests to this KME are removed. Defaults to None.
+        """
+        with self._lock:
+            if sae_id is None and kme_hostname is None:
+                self._entries.clear()
+                return
+            for key in [
+                key
+                for key in self._entries
+                if sae_id in (None, key[2]) and kme_hostname in (None, key[0])
+            ]:
+                del self._entries[key]
@@ -24,7 +24,10 @@ import logging
 from typing import Tuple
 
 from etsi_qkd_014_client import __version__
+from etsi_qkd_014_client.bench import run_bench
 from etsi_qkd_014_client.client import QKD014Client
+from etsi_qkd_014_client.daemon import KeyDeliveryDaemon
+from etsi_qkd_014_client.transport import HTTP2Transport
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +57,51 @@ def main() -> None:
     )
     get_key_with_id_parser.set_defaults(func=get_key_with_id)
 
+    bench_parser = subparsers.add_parser(
+        "bench", help="Generate load on the KME and measure the results"
+    )
+    bench_parser.add_argument(
+        "--command",
+        choices=["get_status", "get_key", "get_key_with_id"],
+        default="get_status",
+        help="Command to call. Defaults to get_status.",
+    )
+    bench_parser.add_argument(
+        "--key-id", help="KEY ID, required for the get_key_with_id command."
+    )
+    bench_parser.add_argument(
+        "--number", type=int, help="Number of keys requested by get_key."
+    )
+    bench_parser.add_argument(
+        "--size", type=int, help="Size of the keys requested by get_key, in bits."
+    )
+    bench_parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=10,
+        help="Duration of the run, in seconds. Defaults to 10.",
+    )
+    bench_parser.add_argument(
+        "-n",
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of concurrent requests. Defaults to 1.",
+    )
+    bench_parser.add_argument(
+        "--rate",
+        type=float,
+        help="Target number of requests per second. Defaults to as fast as possible.",
+    )
+    bench_parser.add_argument(
+        "--http2", action="store_true", help="Use the HTTP/2 transport."
+    )
+    bench_parser.add_argument(
+        "--profile", help="Profile the requests with cProfile and save the stats."
+    )
+    bench_parser.set_defaults(func=bench)
+
     parser.add_argument(
         "sae_id", help="ID of the SAE (slave or master depending on the command)"
     )
@@ -73,6 +121,77 @@ def main() -> None:
         print("No command specified. Run with -h|--help to see the possible commands.")
 
 
+def daemon() -> None:
+    """
+    Entrypoint of the key delivery daemon.
+    """
+    parser = argparse.ArgumentParser(prog="qkd014-daemon")
+    parser.add_argument("--version", action="version", version=__version__)
+    parser.add_argument("socket", help="Path of the Unix domain socket to listen on.")
+    parser.add_argument(
+        "-s",
+        "--sae",
+        action="append",
+        default=[],
+        help="ID of a slave SAE for which keys are prefetched. Can be given several times.",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        help="Size of the prefetched keys in bits. Defaults to the default size of the KME.",
+    )
+    parser.add_argument(
+        "--buffer",
+        type=int,
+        default=64,
+        help="Number of keys to keep in the buffer of each slave SAE.",
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=16,
+        help="Number of keys requested to the KME when refilling a buffer.",
+    )
+    parser.add_argument(
+        "--mode",
+        type=lambda mode: int(mode, 8),
+        default=0o600,
+        help="Permissions of the Unix domain socket, in octal. Defaults to 600.",
+    )
+    parser.add_argument("-H", "--hostname", help="Hostname of the KME.")
+    parser.add_argument("-c", "--cert", help="Path of the certificate file.")
+    parser.add_argument("-k", "--key", help="Path of the key file.")
+    parser.add_argument("-r", "--ca", help="Path of the root CA file.")
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="Force insecure protocol ?"
+    )
+    parser.add_argument("-C", "--config", help="Give path of the configuration file.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    hostname, cert, key, root_ca, force = read_args(args)
+
+    client = QKD014Client(hostname, cert, key, root_ca, force_insecure=force)
+    key_daemon = KeyDeliveryDaemon(
+        client,
+        args.socket,
+        slave_sae_ids=args.sae,
+        key_size=args.size,
+        buffer_size=args.buffer,
+        batch_size=args.batch,
+        mode=args.mode,
+    )
+
+    try:
+        key_daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        key_daemon.stop()
+        client.close()
+
+
 def read_args(args: argparse.Namespace) -> Tuple[str, str, str, str, bool]:
     """Read the args passed to the command line.
 
@@ -224,5 +343,59 @@ def get_key_with_id(args: argparse.Namespace) -> None:
     print(response)
 
 
+def bench(args: argparse.Namespace) -> None:
+    """Bench command.
+
+    Args:
+        args (argparse.Namespace): args passed to the command line.
+
+    Raises:
+        Exception: Missing key ID for the get_key_with_id command.
+    """
+    hostname, cert, key, root_ca, force = read_args(args)
+
+    sae_id = args.sae_id
+
+    transport = None
+    if args.http2:
+        transport = HTTP2Transport(cert, key, root_ca, force)
+    client = QKD014Client(
+        hostname, cert, key, root_ca, force_insecure=force, transport=transport
+    )
+
+    if args.command == "get_status":
+
+        def call():
+            return client.get_status(sae_id)
+
+    elif args.command == "get_key":
+
+        def call():
+            return client.get_key(sae_id, number=args.number, size=args.size)
+
+    else:
+        if args.key_id is None:
+            raise Exception(
+                "key id is missing. Give the key id with --key-id for the get_key_with_id command."
+            )
+
+        def call():
+            return client.get_key_with_key_IDs(sae_id, [args.key_id])
+
+    result = run_bench(
+        call,
+        args.duration,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        profile=args.profile is not None,
+    )
+    client.close()
+
+    print(result)
+    if result.stats is not None:
+        result.stats.dump_stats(args.profile)
+        result.stats.sort_stats("cumulative").print_stats(20)
+
+
 if __name__ == "__main__":
     main()
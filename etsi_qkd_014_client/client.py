@@ -17,19 +17,24 @@
 """
 File holding the main class for the QKD 014 client.
 """
-from typing import Tuple
-
-import requests
-
+import asyncio
+import base64
+import collections
+from typing import AsyncIterator, Iterator, Tuple
 
+from .cache import ErrorCache
 from .data import (
     DataError,
     DataKeyContainer,
     DataKeyIDs,
     DataKeyRequest,
+    DataKeyStream,
     DataStatus,
     QKD014Data,
 )
+from .pipeline import BatchPipeline
+from .tracing import NULL_SPAN, Tracer
+from .transport import QKD014Transport, RequestsTransport
 
 
 class QKD014Client:
@@ -46,6 +51,9 @@ class QKD014Client:
         key_path: str,
         ca_path: str,
         force_insecure: bool = False,
+        transport: QKD014Transport = None,
+        tracer: Tracer = None,
+        error_cache: ErrorCache = None,
     ) -> None:
         """Init the client.
 
@@ -55,60 +63,156 @@ class QKD014Client:
             key_path (str): path of the secret key associated to the certificate of the client.
             ca_path (str): path of the root CA that will be used to check the autenticity of the certificate of the server.
             force_insecure (bool, optional): If true, the client will not proceed to the authenticity verification of the server. Defaults to False.
+            transport (QKD014Transport, optional): transport used to make the requests to the KME. If None is given, a RequestsTransport (HTTP/1.1) is created from the TLS parameters. Defaults to None.
+            tracer (Tracer, optional): tracer receiving a span for each request, with the duration of each phase of the request. If None is given, tracing is disabled. Defaults to None.
+            error_cache (ErrorCache, optional): cache of the error responses. When an error is cached for a request, the same request returns the cached error without reaching the KME. If None is given, errors are not cached. Defaults to None.
         """
         self.kme_hostname = kme_hostname
         self.cert_path = cert_path
         self.key_path = key_path
         self.ca_path = ca_path
         self.force_insecure = force_insecure
+        if transport is None:
+            transport = RequestsTransport(
+                self.cert_path, self.key_path, self.ca_path, self.force_insecure
+            )
+        self.transport = transport
+        self.tracer = tracer
+        self.error_cache = error_cache
+
+    def _start_span(self, name: str, sae_id: str):
+        """Start the span of a request.
+
+        Args:
+            name (str): name of the command.
+            sae_id (str): SAE ID given to the command.
 
-    def _get(self, url: str) -> requests.Response:
+        Returns:
+            Span: the span, or NULL_SPAN if tracing is disabled.
+        """
+        if self.tracer is None:
+            return NULL_SPAN
+        return self.tracer.start_span(
+            name, kme_hostname=self.kme_hostname, sae_id=sae_id
+        )
+
+    def _get(self, url: str, span=NULL_SPAN, stream: bool = False):
         """An alias to make a GET request.
 
-        This automatically sets the verify and cert arguments of the get command.
+        The request is made through the transport of the client, that holds the TLS configuration.
 
         Args:
             url (str): target URL
+            span (Span, optional): span of the request. It is ended if the request fails. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of a successful response is not read. Defaults to False.
 
         Returns:
-            requests.Response: the response of the request.
+            the response of the request.
         """
-        if self.force_insecure:
-            verify = False
-        else:
-            verify = self.ca_path
-
-        return requests.get(
-            url, verify=verify, cert=(self.cert_path, self.key_path), timeout=10
-        )
-
-    def _post(self, url: str, data: dict) -> requests.Response:
+        try:
+            return self.transport.get(url, span, stream)
+        except Exception as exc:
+            span.set_attribute("error", repr(exc))
+            span.end()
+            raise
+
+    def _post(self, url: str, data: dict, span=NULL_SPAN, stream: bool = False):
         """An alias to make a POST request.
 
-        This automatically sets the verify and cert arguments of the post command.
+        The request is made through the transport of the client, that holds the TLS configuration.
 
         Args:
             url (str): target URL.
             data (dict): data of the request.
+            span (Span, optional): span of the request. It is ended if the request fails. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of a successful response is not read. Defaults to False.
 
         Returns:
-            requests.Response: response of the request.
+            the response of the request.
         """
-        if self.force_insecure:
-            verify = False
-        else:
-            verify = self.ca_path
-
-        return requests.post(
-            url,
-            json=data,
-            verify=verify,
-            cert=(
-                self.cert_path,
-                self.key_path,
-            ),
-            timeout=10,
-        )
+        try:
+            return self.transport.post(url, data, span, stream)
+        except Exception as exc:
+            span.set_attribute("error", repr(exc))
+            span.end()
+            raise
+
+    def _cached_error(self, cache_key: Tuple) -> Tuple[int, QKD014Data]:
+        """Get the cached error of a request.
+
+        Args:
+            cache_key (Tuple): key of the request in the error cache.
+
+        Returns:
+            (int, QKD014Data): the response code and DataError, or None if no error is cached.
+        """
+        if self.error_cache is None:
+            return None
+        return self.error_cache.get(cache_key)
+
+    def _cache_error(self, cache_key: Tuple, code: int, data: QKD014Data) -> None:
+        """Cache the error of a request.
+
+        Args:
+            cache_key (Tuple): key of the request in the error cache.
+            code (int): response code.
+            data (QKD014Data): response data.
+        """
+        if self.error_cache is not None and code != 200:
+            self.error_cache.put(cache_key, code, data)
+
+    def _parse(self, response, data_class, span=NULL_SPAN) -> Tuple[int, QKD014Data]:
+        """Build the data instance from the response and end the span of the request.
+
+        The span is also ended if the response cannot be decoded.
+
+        Args:
+            response: response of the request.
+            data_class: class of the data returned in case of success.
+            span (Span, optional): span of the request. Defaults to NULL_SPAN.
+
+        Returns:
+            (int, QKD014Data): The response code and an instance of data_class or DataError.
+        """
+        span.set_attribute("status_code", response.status_code)
+        try:
+            content = response.json()
+            span.mark("json_decode")
+
+            if response.status_code != 200:
+                code, data = response.status_code, DataError(content)
+            else:
+                code, data = 200, data_class(content)
+            span.mark("data")
+        except Exception as exc:
+            span.set_attribute("error", repr(exc))
+            raise
+        finally:
+            span.end()
+        return code, data
+
+    def _parse_stream(self, response, span=NULL_SPAN) -> Tuple[int, QKD014Data]:
+        """Build a key stream from a streamed response and end the span of the request.
+
+        Error responses are fully read and parsed as usual. The span ends when the
+        response headers are received, before the keys are read.
+
+        Args:
+            response: streamed response of the request.
+            span (Span, optional): span of the request. Defaults to NULL_SPAN.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyStream or DataError.
+        """
+        if response.status_code != 200:
+            return self._parse(response, DataKeyContainer, span)
+        span.set_attribute("status_code", 200)
+        span.end()
+        return 200, DataKeyStream(self.transport.iter_content(response))
+
+    def close(self) -> None:
+        """Close the connections held by the transport of the client."""
+        self.transport.close()
 
     def get_status(self, slave_sae_id: str) -> Tuple[int, QKD014Data]:
         """Get status command.
@@ -120,11 +224,17 @@ class QKD014Client:
             (int, QKD014Data): The first is the response code (200, 400, 401, 503). The second is an instance of QKD014Data. In this case it may be DataStatus or DataError.
         """
         url = f"https://{self.kme_hostname}/api/v1/keys/{slave_sae_id}/status"
-        response = self._get(url)
+        cache_key = ErrorCache.make_key(self.kme_hostname, "get_status", slave_sae_id)
+        cached = self._cached_error(cache_key)
+        if cached is not None:
+            return cached
 
-        if response.status_code != 200:
-            return response.status_code, DataError(response.json())
-        return 200, DataStatus(response.json())
+        span = self._start_span("get_status", slave_sae_id)
+        response = self._get(url, span)
+
+        code, data = self._parse(response, DataStatus, span)
+        self._cache_error(cache_key, code, data)
+        return code, data
 
     def get_key(
         self,
@@ -134,6 +244,7 @@ class QKD014Client:
         additional_slave_sae_ids: list[str] = None,
         extension_mandatory: dict = None,
         extension_optional: dict = None,
+        stream: bool = False,
     ) -> Tuple[int, QKD014Data]:
         """Get key command.
 
@@ -147,9 +258,10 @@ class QKD014Client:
             additional_slave_sae_ids (list[str], optional): Array of IDs of slave SAEs. It is used for specifying two or more slave SAEs to share identical keys. The maximum number of IDs is defined as max_sae_id_count in Status data format. Defaults to None.
             extension_mandatory (dict, optional): Array of extension parameters specified as name/value pairs that KME shall handle or return an error. Parameter values may be of any type, including objects. Defaults to None.
             extension_optional (dict, optional): Array of extension parameters specified as name/value pairs that KME may ignore. Parameter values may be of any type, including objects. Defaults to None.
+            stream (bool, optional): If true, the keys are parsed while the response is received, and a DataKeyStream is returned instead of a DataKeyContainer. Defaults to False.
 
         Returns:
-            (int, QKD014Data): The first is the response code (200, 400, 401, 503). The second is an instance of QKD014Data. In this case it may be DataKeyContainer or DataError.
+            (int, QKD014Data): The first is the response code (200, 400, 401, 503). The second is an instance of QKD014Data. In this case it may be DataKeyContainer (DataKeyStream if stream is true) or DataError.
         """
         url = f"https://{self.kme_hostname}/api/v1/keys/{slave_sae_id}/enc_keys"
         if (
@@ -160,21 +272,36 @@ class QKD014Client:
             and extension_optional is None
         ):
             # In this case, we are the simplified version case and we can juste make a GET request
-            response = self._get(url)
+            request_data = None
         else:
             # We need to create the data object and pass it to the post request
-            data = DataKeyRequest(
+            request_data = DataKeyRequest(
                 number,
                 size,
                 additional_slave_sae_ids,
                 extension_mandatory,
                 extension_optional,
-            )
-            response = self._post(url, data.json())
+            ).json()
 
-        if response.status_code != 200:
-            return response.status_code, DataError(response.json())
-        return 200, DataKeyContainer(response.json())
+        cache_key = ErrorCache.make_key(
+            self.kme_hostname, "get_key", slave_sae_id, request_data
+        )
+        cached = self._cached_error(cache_key)
+        if cached is not None:
+            return cached
+
+        span = self._start_span("get_key", slave_sae_id)
+        if request_data is None:
+            response = self._get(url, span, stream)
+        else:
+            response = self._post(url, request_data, span, stream)
+
+        if stream:
+            code, data = self._parse_stream(response, span)
+        else:
+            code, data = self._parse(response, DataKeyContainer, span)
+        self._cache_error(cache_key, code, data)
+        return code, data
 
     def get_key_with_key_IDs(
         self,
@@ -182,6 +309,7 @@ class QKD014Client:
         key_ids: list[str],
         key_ids_extensions: list[object] = None,
         key_ids_extension: object = None,
+        stream: bool = False,
     ) -> Tuple[int, QKD014Data]:
         """Get key with key IDs command.
 
@@ -190,18 +318,125 @@ class QKD014Client:
             key_ids (list[str]): list of key IDs in the UUID format (example: "550e8400-e29b-41d4-a716-446655440000")
             key_ids_extensions (list[object], optional): Reserved for future use. Defaults to None.
             key_ids_extension (object, optional): Reserved for future use. Defaults to None.
+            stream (bool, optional): If true, the keys are parsed while the response is received, and a DataKeyStream is returned instead of a DataKeyContainer. Defaults to False.
 
         Returns:
-            (int, QKD014Data): The first is the response code (200, 400, 401, 503). The second is an instance of QKD014Data. In this case it may be DataKeyContainer or DataError.
+            (int, QKD014Data): The first is the response code (200, 400, 401, 503). The second is an instance of QKD014Data. In this case it may be DataKeyContainer (DataKeyStream if stream is true) or DataError.
         """
         url = f"https://{self.kme_hostname}/api/v1/keys/{master_sae_id}/dec_keys"
-        data = DataKeyIDs(key_ids, key_ids_extensions, key_ids_extension)
+        request_data = DataKeyIDs(key_ids, key_ids_extensions, key_ids_extension).json()
 
-        response = self._post(url, data.json())
+        cache_key = ErrorCache.make_key(
+            self.kme_hostname, "get_key_with_key_IDs", master_sae_id, request_data
+        )
+        cached = self._cached_error(cache_key)
+        if cached is not None:
+            return cached
 
-        if response.status_code != 200:
-            return response.status_code, DataError(response.json())
-        return 200, DataKeyContainer(response.json())
+        span = self._start_span("get_key_with_key_IDs", master_sae_id)
+        response = self._post(url, request_data, span, stream)
+
+        if stream:
+            code, data = self._parse_stream(response, span)
+        else:
+            code, data = self._parse(response, DataKeyContainer, span)
+        self._cache_error(cache_key, code, data)
+        return code, data
+
+    def iter_keys(
+        self,
+        slave_sae_id: str,
+        size: int = None,
+        batch: int = 1,
+        depth: int = 2,
+        raw: bool = False,
+    ) -> Iterator:
+        """Iterate over an endless stream of keys.
+
+        Up to depth get key requests are kept in flight ahead of the consumption of
+        the keys. A new request is only made when the keys of a previous one have
+        been consumed, which bounds the number of keys fetched in advance.
+
+        Closing the iterator cancels the requests that were not started yet. The
+        keys of the requests already in flight are discarded.
+
+        Args:
+            slave_sae_id (str): URL-encoded SAE ID of slave SAE.
+            size (int, optional): Size of each key in bits, if None is given, server's default value is defined as key_size in Status data format. Defaults to None.
+            batch (int, optional): Number of keys requested in each request. Defaults to 1.
+            depth (int, optional): Number of requests kept in flight. Defaults to 2.
+            raw (bool, optional): If true, the keys are yielded as bytes instead of DataKey instances. Defaults to False.
+
+        Raises:
+            Exception: if a request returns an error.
+
+        Yields:
+            DataKey or bytes: the keys.
+        """
+
+        def fetch(_index: int) -> list:
+            """Get a batch of keys.
+
+            Raises:
+                Exception: if the request returns an error.
+
+            Returns:
+                list: the keys of the batch.
+            """
+            code, data = self.get_key(slave_sae_id, number=batch, size=size)
+            if code != 200:
+                raise Exception(f"Could not get keys ({code}) : {data.message}")
+            return [base64.b64decode(key.key) if raw else key for key in data.keys]
+
+        yield from BatchPipeline(fetch, depth)
+
+    async def aiter_keys(
+        self,
+        slave_sae_id: str,
+        size: int = None,
+        batch: int = 1,
+        depth: int = 2,
+        raw: bool = False,
+    ) -> AsyncIterator:
+        """Asynchronously iterate over an endless stream of keys.
+
+        This is the asynchronous version of :func:`iter_keys`. The requests are made
+        in the default executor of the event loop.
+
+        Args:
+            slave_sae_id (str): URL-encoded SAE ID of slave SAE.
+            size (int, optional): Size of each key in bits, if None is given, server's default value is defined as key_size in Status data format. Defaults to None.
+            batch (int, optional): Number of keys requested in each request. Defaults to 1.
+            depth (int, optional): Number of requests kept in flight. Defaults to 2.
+            raw (bool, optional): If true, the keys are yielded as bytes instead of DataKey instances. Defaults to False.
+
+        Raises:
+            Exception: if a request returns an error.
+
+        Yields:
+            DataKey or bytes: the keys.
+        """
+        loop = asyncio.get_running_loop()
+        pending = collections.deque()
+        try:
+            while True:
+                while len(pending) < depth:
+                    pending.append(
+                        loop.run_in_executor(
+                            None,
+                            lambda: self.get_key(slave_sae_id, number=batch, size=size),
+                        )
+                    )
+
+                code, data = await pending.popleft()
+                if code != 200:
+                    raise Exception(f"Could not get keys ({code}) : {data.message}")
+
+                for key in data.keys:
+                    yield base64.b64decode(key.key) if raw else key
+        finally:
+            for future in pending:
+                future.cancel()
 
     def __str__(self) -> str:
         """String representation of the client.
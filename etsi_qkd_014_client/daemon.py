@@ -0,0 +1,511 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Key delivery daemon serving keys to local processes over a Unix domain socket.
+
+The daemon holds a single client (and hence the connections to the KME) and a
+buffer of prefetched keys for each slave SAE. Local processes use the
+DaemonClient class to get keys from the daemon.
+
+The protocol is a compact binary protocol. Each request is made of a header
+``!BBHH`` (command, length of the SAE ID, count, size) followed by the SAE ID
+encoded in UTF-8 and, for the get key with key IDs command, count key IDs of
+16 bytes each. The size is the size of the keys in bits for the get key command
+(0 for the default size of the KME) and is unused otherwise.
+
+Each response is made of a header ``!HH`` (response code, count). If the
+response code is 200, it is followed by count keys, each made of the 16 bytes of
+the key ID, the length of the key in bytes on 2 bytes and the key. Otherwise,
+it is followed by an error message encoded in UTF-8 of count bytes.
+"""
+
+import base64
+import collections
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import uuid
+from typing import Tuple
+
+from .client import QKD014Client
+from .data import DataError, DataKey, DataKeyContainer, QKD014Data
+
+logger = logging.getLogger(__name__)
+
+COMMAND_GET_KEY = 1
+COMMAND_GET_KEY_WITH_KEY_IDS = 2
+
+REQUEST_HEADER = struct.Struct("!BBHH")
+RESPONSE_HEADER = struct.Struct("!HH")
+KEY_LENGTH = struct.Struct("!H")
+MAX_COUNT = 0xFFFF  #: Maximum value of the counts and lengths of the protocol.
+
+
+def _recv_exactly(sock: socket.socket, length: int) -> bytes:
+    """Receive exactly length bytes from a socket.
+
+    Args:
+        sock (socket.socket): socket to read from.
+        length (int): number of bytes to read.
+
+    Raises:
+        EOFError: if the connection is closed before all the bytes are received.
+
+    Returns:
+        bytes: the received bytes.
+    """
+    buffer = bytearray()
+    while len(buffer) < length:
+        chunk = sock.recv(length - len(buffer))
+        if not chunk:
+            raise EOFError("Connection closed by peer.")
+        buffer += chunk
+    return bytes(buffer)
+
+
+def check_keys(keys: list[DataKey]) -> None:
+    """Check that keys can be encoded in a response of the daemon.
+
+    Args:
+        keys (list[DataKey]): the keys.
+
+    Raises:
+        ValueError: if there are more than 65535 keys, if a key ID is not a UUID or if a key is longer than 65535 bytes.
+    """
+    if len(keys) > MAX_COUNT:
+        raise ValueError(f"Too many keys for a single response ({len(keys)}).")
+    for key in keys:
+        uuid.UUID(key.key_id)
+        if len(base64.b64decode(key.key)) > MAX_COUNT:
+            raise ValueError(f"Key {key.key_id} is too long.")
+
+
+def encode_response(code: int, data: QKD014Data) -> bytes:
+    """Encode a response of the daemon.
+
+    Error messages longer than 65535 bytes are truncated.
+
+    Args:
+        code (int): response code.
+        data (QKD014Data): DataKeyContainer if the response code is 200, DataError otherwise.
+
+    Raises:
+        ValueError: if the keys cannot be encoded.
+
+    Returns:
+        bytes: the encoded response.
+    """
+    if code != 200:
+        message = data.message.encode("utf-8")[:MAX_COUNT]
+        return RESPONSE_HEADER.pack(code, len(message)) + message
+
+    check_keys(data.keys)
+
+    parts = [RESPONSE_HEADER.pack(code, len(data.keys))]
+    for key in data.keys:
+        key_bytes = base64.b64decode(key.key)
+        parts.append(uuid.UUID(key.key_id).bytes)
+        parts.append(KEY_LENGTH.pack(len(key_bytes)))
+        parts.append(key_bytes)
+    return b"".join(parts)
+
+
+class KeyDeliveryDaemon:
+    """
+    Daemon delivering keys to local processes over a Unix domain socket.
+
+    Keys are prefetched for the configured slave SAEs, so that most of the
+    requests are served from memory.
+    """
+
+    def __init__(
+        self,
+        client: QKD014Client,
+        socket_path: str,
+        slave_sae_ids: list[str] = None,
+        key_size: int = None,
+        buffer_size: int = 64,
+        batch_size: int = 16,
+        retry_interval: float = 1,
+        mode: int = 0o600,
+    ) -> None:
+        """Init the daemon.
+
+        Args:
+            client (QKD014Client): client used to get the keys from the KME.
+            socket_path (str): path of the Unix domain socket to listen on.
+            slave_sae_ids (list[str], optional): IDs of the slave SAEs for which keys are prefetched. Defaults to None.
+            key_size (int, optional): size of the prefetched keys in bits, if None is given, the default size of the KME is used. Defaults to None.
+            buffer_size (int, optional): number of keys to keep in the buffer of each slave SAE. Defaults to 64.
+            batch_size (int, optional): number of keys requested to the KME when refilling a buffer. Defaults to 16.
+            retry_interval (float, optional): time to wait before refilling a buffer after an error, in seconds. Defaults to 1.
+            mode (int, optional): permissions of the Unix domain socket. Only the processes allowed to connect to the socket can get keys. Defaults to 0o600.
+        """
+        self.client = client
+        self.socket_path = socket_path
+        self.mode = mode
+        self.key_size = key_size
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+
+        self._buffers = {}
+        for slave_sae_id in slave_sae_ids or []:
+            self._buffers[slave_sae_id] = collections.deque()
+        self._lock = threading.Lock()
+        self._refill_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._refill_thread = None
+        self._server = None
+        self._serving = False
+
+    def _fetch(
+        self, slave_sae_id: str, number: int, size: int = None
+    ) -> Tuple[int, QKD014Data]:
+        """Fetch keys from the KME.
+
+        Args:
+            slave_sae_id (str): ID of the slave SAE.
+            number (int): number of keys.
+            size (int, optional): size of the keys in bits. Defaults to None.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        return self.client.get_key(slave_sae_id, number=number, size=size)
+
+    def _refill(self) -> None:
+        """Refill the buffers of the slave SAEs until the daemon is stopped."""
+        while not self._stop_event.is_set():
+            self._refill_event.clear()
+            failed = False
+            for slave_sae_id, buffer in self._buffers.items():
+                while len(buffer) < self.buffer_size and not self._stop_event.is_set():
+                    number = min(self.batch_size, self.buffer_size - len(buffer))
+                    try:
+                        code, data = self._fetch(slave_sae_id, number, self.key_size)
+                        if code == 200:
+                            check_keys(data.keys)
+                    except Exception as exc:  # pylint: disable=broad-except
+                        logger.warning(
+                            "Could not refill keys for %s: %s", slave_sae_id, exc
+                        )
+                        failed = True
+                        break
+                    if code != 200:
+                        logger.warning(
+                            "Could not refill keys for %s: %s %s",
+                            slave_sae_id,
+                            code,
+                            data.message,
+                        )
+                        failed = True
+                        break
+                    with self._lock:
+                        buffer.extend(data.keys)
+
+            if failed:
+                self._stop_event.wait(self.retry_interval)
+            else:
+                self._refill_event.wait()
+
+    def _give_back(self, buffer: collections.deque, keys: list[DataKey]) -> None:
+        """Give keys taken from a buffer back to it, in their original order.
+
+        Args:
+            buffer (collections.deque): the buffer.
+            keys (list[DataKey]): the keys.
+        """
+        with self._lock:
+            buffer.extendleft(reversed(keys))
+
+    def get_key(
+        self, slave_sae_id: str, number: int = 1, size: int = None
+    ) -> Tuple[int, QKD014Data]:
+        """Get keys, from the buffer if possible.
+
+        If the keys cannot all be delivered, the keys taken from the buffer are
+        given back to it.
+
+        Args:
+            slave_sae_id (str): ID of the slave SAE.
+            number (int, optional): number of keys. Defaults to 1.
+            size (int, optional): size of the keys in bits, if None is given, the size of the prefetched keys is used. Defaults to None.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        buffer = self._buffers.get(slave_sae_id)
+        if buffer is None or (size is not None and size != self.key_size):
+            return self._fetch(slave_sae_id, number, size)
+
+        keys = []
+        with self._lock:
+            while buffer and len(keys) < number:
+                keys.append(buffer.popleft())
+        self._refill_event.set()
+
+        if len(keys) < number:
+            try:
+                code, data = self._fetch(
+                    slave_sae_id, number - len(keys), self.key_size
+                )
+                if code == 200:
+                    check_keys(keys + data.keys)
+            except Exception:
+                self._give_back(buffer, keys)
+                raise
+            if code != 200:
+                self._give_back(buffer, keys)
+                return code, data
+            keys.extend(data.keys)
+
+        return 200, DataKeyContainer(
+            {"keys": [{"key_ID": key.key_id, "key": key.key} for key in keys]}
+        )
+
+    def get_key_with_key_IDs(
+        self, master_sae_id: str, key_ids: list[str]
+    ) -> Tuple[int, QKD014Data]:
+        """Get keys with their IDs from the KME.
+
+        Args:
+            master_sae_id (str): ID of the master SAE.
+            key_ids (list[str]): IDs of the keys.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        return self.client.get_key_with_key_IDs(master_sae_id, key_ids)
+
+    def handle_request(self, sock: socket.socket) -> bytes:
+        """Read a request from a socket and compute the encoded response.
+
+        Args:
+            sock (socket.socket): socket connected to the local process.
+
+        Returns:
+            bytes: the encoded response.
+        """
+        command, sae_id_length, count, size = REQUEST_HEADER.unpack(
+            _recv_exactly(sock, REQUEST_HEADER.size)
+        )
+        sae_id = _recv_exactly(sock, sae_id_length).decode("utf-8")
+
+        key_ids = None
+        if command == COMMAND_GET_KEY_WITH_KEY_IDS:
+            raw_ids = _recv_exactly(sock, 16 * count)
+            key_ids = [
+                str(uuid.UUID(bytes=raw_ids[i : i + 16]))
+                for i in range(0, len(raw_ids), 16)
+            ]
+
+        try:
+            if command == COMMAND_GET_KEY:
+                code, data = self.get_key(sae_id, count, size or None)
+            elif command == COMMAND_GET_KEY_WITH_KEY_IDS:
+                code, data = self.get_key_with_key_IDs(sae_id, key_ids)
+            else:
+                code, data = 400, DataError({"message": f"Unknown command {command}"})
+            return encode_response(code, data)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.exception("Error while handling a request.")
+            return encode_response(503, DataError({"message": str(exc)}))
+
+    def start(self) -> None:
+        """Start the prefetching thread and listen on the Unix domain socket.
+
+        A socket left at the path by a previous run is removed. The permissions
+        of the socket are set before listening, so that no other process can
+        connect in between.
+
+        Raises:
+            Exception: if the path exists and is not a socket.
+        """
+        try:
+            path_stat = os.lstat(self.socket_path)
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(path_stat.st_mode):
+                raise Exception(f"{self.socket_path} exists and is not a socket.")
+            os.unlink(self.socket_path)
+
+        daemon = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            """Handler of a connection from a local process."""
+
+            def handle(self) -> None:
+                """Serve requests until the local process closes the connection."""
+                while True:
+                    try:
+                        response = daemon.handle_request(self.request)
+                    except EOFError:
+                        return
+                    self.request.sendall(response)
+
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, Handler, bind_and_activate=False
+        )
+        self._server.daemon_threads = True
+        try:
+            self._server.server_bind()
+            os.chmod(self.socket_path, self.mode)
+            self._server.server_activate()
+        except Exception:
+            self._server.server_close()
+            self._server = None
+            raise
+
+        self._stop_event.clear()
+        self._refill_thread = threading.Thread(target=self._refill, daemon=True)
+        self._refill_thread.start()
+        logger.info("Key delivery daemon listening on %s", self.socket_path)
+
+    def serve_forever(self) -> None:
+        """Start the daemon if needed and serve requests until it is stopped."""
+        if self._server is None:
+            self.start()
+        with self._lock:
+            self._serving = True
+        try:
+            self._server.serve_forever()
+        finally:
+            with self._lock:
+                self._serving = False
+
+    def stop(self) -> None:
+        """Stop the daemon and remove the Unix domain socket.
+
+        This can be called after start, whether serve_forever was called or not.
+        """
+        self._stop_event.set()
+        self._refill_event.set()
+        if self._server is not None:
+            with self._lock:
+                serving = self._serving
+            # shutdown waits for the end of serve_forever, which never ends if it never started.
+            if serving:
+                self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class DaemonClient:
+    """
+    Client for the key delivery daemon.
+
+    It exposes the same methods as QKD014Client to get keys, with the same
+    return values.
+    """
+
+    def __init__(self, socket_path: str) -> None:
+        """Init the client.
+
+        Args:
+            socket_path (str): path of the Unix domain socket of the daemon.
+        """
+        self.socket_path = socket_path
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _request(self, header: bytes, payload: bytes) -> Tuple[int, QKD014Data]:
+        """Send a request to the daemon and read its response.
+
+        Args:
+            header (bytes): encoded header of the request.
+            payload (bytes): encoded payload of the request.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        with self._lock:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.connect(self.socket_path)
+
+            try:
+                self._sock.sendall(header + payload)
+                code, count = RESPONSE_HEADER.unpack(
+                    _recv_exactly(self._sock, RESPONSE_HEADER.size)
+                )
+                if code != 200:
+                    message = _recv_exactly(self._sock, count).decode("utf-8")
+                    return code, DataError({"message": message})
+
+                keys = []
+                for _ in range(count):
+                    key_id = uuid.UUID(bytes=_recv_exactly(self._sock, 16))
+                    (length,) = KEY_LENGTH.unpack(
+                        _recv_exactly(self._sock, KEY_LENGTH.size)
+                    )
+                    key = base64.b64encode(_recv_exactly(self._sock, length))
+                    keys.append({"key_ID": str(key_id), "key": key.decode("ascii")})
+            except (EOFError, OSError):
+                self.close()
+                raise
+
+        return 200, DataKeyContainer({"keys": keys})
+
+    def get_key(
+        self, slave_sae_id: str, number: int = 1, size: int = None
+    ) -> Tuple[int, QKD014Data]:
+        """Get key command.
+
+        Args:
+            slave_sae_id (str): ID of the slave SAE.
+            number (int, optional): number of keys. Defaults to 1.
+            size (int, optional): size of the keys in bits, if None is given, the size of the keys prefetched by the daemon is used. Defaults to None.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        sae_id = slave_sae_id.encode("utf-8")
+        header = REQUEST_HEADER.pack(COMMAND_GET_KEY, len(sae_id), number, size or 0)
+        return self._request(header, sae_id)
+
+    def get_key_with_key_IDs(
+        self, master_sae_id: str, key_ids: list[str]
+    ) -> Tuple[int, QKD014Data]:
+        """Get key with key IDs command.
+
+        Args:
+            master_sae_id (str): ID of the master SAE.
+            key_ids (list[str]): IDs of the keys in the UUID format.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        sae_id = master_sae_id.encode("utf-8")
+        header = REQUEST_HEADER.pack(
+            COMMAND_GET_KEY_WITH_KEY_IDS, len(sae_id), len(key_ids), 0
+        )
+        payload = sae_id + b"".join(uuid.UUID(key_id).bytes for key_id in key_ids)
+        return self._request(header, payload)
+
+    def close(self) -> None:
+        """Close the connection to the daemon."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
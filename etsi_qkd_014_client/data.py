@@ -19,9 +19,17 @@ Classes for the data structures
 """
 
 import abc
+import codecs
+import json
+import re
+from json.decoder import scanstring
+from typing import Iterable, Iterator
 
 ETSI_QKD_014_PROTOCOL_VERSION = "1.1.1"
 
+_JSON_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+_JSON_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
 
 class QKD014Data(abc.ABC):
     """
@@ -276,6 +284,223 @@ class DataKeyContainer(QKD014Data):
         return res
 
 
+class DataKeyStream(QKD014Data):
+    """
+    Class representing the data response of the get key command, parsed incrementally.
+
+    Contrary to DataKeyContainer, the keys are parsed from the response body as it
+    is received and yielded one by one when iterating over the instance, so that
+    the memory used does not depend on the number of keys. The instance can only
+    be iterated once.
+    """
+
+    key_container_extension: object  #: (Option) for future use. Only set once the iteration is over.
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        """Init the instance
+
+        Args:
+            chunks (Iterable[bytes]): chunks of the response body of the get key command.
+        """
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self.key_container_extension = None
+
+    def _error(self, exc: Exception = None) -> None:
+        """Raise an exception because the data does not meet the specifications.
+
+        Args:
+            exc (Exception, optional): cause of the exception. Defaults to None.
+
+        Raises:
+            Exception: the data does not meet the specifications.
+        """
+        raise Exception(
+            f"Data does not meet the ETSI QKD 014 specifications for Key Container Data (version {ETSI_QKD_014_PROTOCOL_VERSION})"
+        ) from exc
+
+    def _read(self) -> bool:
+        """Append the next chunk to the buffer, dropping the data already parsed.
+
+        Returns:
+            bool: False if there is no more chunk.
+        """
+        if self._eof:
+            return False
+        try:
+            text = self._text_decoder.decode(next(self._chunks))
+        except StopIteration:
+            self._eof = True
+            text = self._text_decoder.decode(b"", final=True)
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+        return not self._eof
+
+    def _peek(self) -> str:
+        """Skip the whitespaces and return the next character, without consuming it.
+
+        Returns:
+            str: the next character.
+        """
+        while True:
+            while (
+                self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\n\r"
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                self._error()
+
+    def _expect(self, char: str) -> None:
+        """Consume the next character, that must be the given one.
+
+        Args:
+            char (str): the expected character.
+        """
+        if self._peek() != char:
+            self._error()
+        self._pos += 1
+
+    def _truncated(self, pos: int, exc: json.JSONDecodeError = None) -> bool:
+        """Tell whether the end of the buffer could be the beginning of a longer value.
+
+        Args:
+            pos (int): position of the decoding error, or end of the decoded value.
+            exc (json.JSONDecodeError, optional): the decoding error. Defaults to None.
+
+        Returns:
+            bool: True if more chunks should be read before decoding again.
+        """
+        remaining = len(self._buffer) - pos
+        if exc is not None and exc.msg.startswith("Unterminated string"):
+            return True
+        if exc is not None and exc.msg.startswith("Invalid \\uXXXX escape"):
+            # The escape is only decoded once the character following it is known.
+            return remaining < 6
+        if remaining < 9 and any(
+            literal.startswith(self._buffer[pos:]) for literal in _JSON_LITERALS
+        ):
+            return True
+        return _JSON_NUMBER_TAIL.match(self._buffer, pos).end() == len(self._buffer)
+
+    def _decode(self, decode) -> object:
+        """Decode the next JSON value, reading more chunks until it is complete.
+
+        Only the errors that can be caused by a value split between chunks lead to
+        reading more chunks. The others are raised right away, without reading the
+        rest of the body.
+
+        Args:
+            decode: function taking the buffer and the position and returning the value and its end.
+
+        Returns:
+            object: the value.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = decode(self._buffer, self._pos)
+            except json.JSONDecodeError as exc:
+                if self._eof or not self._truncated(exc.pos, exc):
+                    self._error(exc)
+                self._read()
+                continue
+
+            # A number ending with the buffer may be truncated.
+            if self._eof or not self._truncated(end):
+                self._pos = end
+                return value
+            self._read()
+
+    def _decode_string(self) -> str:
+        """Decode the next JSON string.
+
+        Returns:
+            str: the string.
+        """
+        if self._peek() != '"':
+            self._error()
+        return self._decode(lambda buffer, pos: scanstring(buffer, pos + 1))
+
+    def __iter__(self) -> Iterator[DataKey]:
+        """Parse the response body and yield the keys.
+
+        The chunks are closed at the end of the iteration, even if it is stopped
+        early, which releases the response of the request.
+
+        Raises:
+            Exception: if the data does not meet the specifications.
+
+        Yields:
+            DataKey: the keys.
+        """
+        try:
+            yield from self._parse()
+        finally:
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
+
+    def _parse(self) -> Iterator[DataKey]:
+        """Parse the response body and yield the keys.
+
+        Raises:
+            Exception: if the data does not meet the specifications.
+
+        Yields:
+            DataKey: the keys.
+        """
+        found_keys = False
+        self._expect("{")
+        while True:
+            name = self._decode_string()
+            self._expect(":")
+
+            if name == "keys":
+                found_keys = True
+                self._expect("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        key_data = self._decode(self._json_decoder.raw_decode)
+                        try:
+                            key = DataKey(
+                                key_data["key_ID"],
+                                key_data["key"],
+                                key_data.get("key_ID_extension"),
+                            )
+                        except (KeyError, TypeError, AttributeError) as exc:
+                            self._error(exc)
+                        yield key
+
+                        separator = self._peek()
+                        self._pos += 1
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            self._error()
+            else:
+                value = self._decode(self._json_decoder.raw_decode)
+                if name == "key_container_extension":
+                    self.key_container_extension = value
+
+            separator = self._peek()
+            self._pos += 1
+            if separator == "}":
+                break
+            if separator != ",":
+                self._error()
+
+        if not found_keys:
+            self._error()
+
+
 class DataKeyIDs(QKD014Data):
 
     """Data strucutre to use as request data for get key with key IDs."""
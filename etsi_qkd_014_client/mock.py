@@ -0,0 +1,332 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process mock of a pair of linked KMEs, used for testing without a QKD network.
+
+The two KMEs share a single key store: the keys delivered to a master SAE with
+the get key command can then be retrieved by the slave SAE with the get key with
+key IDs command, and are removed from the store once delivered to the slave SAE.
+Each SAE talks to the mock through a MockTransport given to its client.
+"""
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Iterator, Tuple
+
+from .client import QKD014Client
+from .tracing import NULL_SPAN
+from .transport import QKD014Transport
+
+_URL_PATTERN = re.compile(
+    r"^https://[^/]+/api/v1/keys/([^/]+)/(status|enc_keys|dec_keys)$"
+)
+
+
+class MockResponse:
+    """
+    Response of the mock KME, with the attributes used by the client.
+    """
+
+    def __init__(self, status_code: int, data: dict) -> None:
+        """Init the response.
+
+        Args:
+            status_code (int): response code.
+            data (dict): response data.
+        """
+        self.status_code = status_code
+        self.content = json.dumps(data).encode()
+
+    def json(self) -> dict:
+        """Decode the response body.
+
+        Returns:
+            dict: the response data.
+        """
+        return json.loads(self.content)
+
+
+class MockKME:
+    """
+    Pair of linked KMEs sharing a key store.
+    """
+
+    def __init__(
+        self,
+        key_size: int = 256,
+        min_key_size: int = 64,
+        max_key_size: int = 1024,
+        max_key_per_request: int = 128,
+        max_key_count: int = 100000,
+        latency: float = 0,
+    ) -> None:
+        """Init the KMEs, with an empty key store.
+
+        Args:
+            key_size (int, optional): default size of the keys, in bits. Defaults to 256.
+            min_key_size (int, optional): minimum size of the keys, in bits. Defaults to 64.
+            max_key_size (int, optional): maximum size of the keys, in bits. Defaults to 1024.
+            max_key_per_request (int, optional): maximum number of keys per request. Defaults to 128.
+            max_key_count (int, optional): maximum number of keys waiting to be delivered to the slave SAEs. Defaults to 100000.
+            latency (float, optional): time taken by each request, in seconds, to emulate the round trip to a remote KME. Defaults to 0.
+        """
+        self.key_size = key_size
+        self.min_key_size = min_key_size
+        self.max_key_size = max_key_size
+        self.max_key_per_request = max_key_per_request
+        self.max_key_count = max_key_count
+        self.latency = latency
+
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def transport(self, sae_id: str) -> "MockTransport":
+        """Get a transport to the KME of a SAE.
+
+        Args:
+            sae_id (str): ID of the SAE using the transport.
+
+        Returns:
+            MockTransport: the transport.
+        """
+        return MockTransport(self, sae_id)
+
+    def client(self, sae_id: str, **kwargs) -> QKD014Client:
+        """Get a client connected to the KME of a SAE.
+
+        Args:
+            sae_id (str): ID of the SAE using the client.
+            kwargs: other arguments of the client.
+
+        Returns:
+            QKD014Client: the client.
+        """
+        return QKD014Client(
+            f"kme-{sae_id}",
+            None,
+            None,
+            None,
+            transport=self.transport(sae_id),
+            **kwargs,
+        )
+
+    def stored_key_count(self, master_sae_id: str, slave_sae_id: str) -> int:
+        """Get the number of keys waiting to be delivered to a slave SAE.
+
+        Args:
+            master_sae_id (str): ID of the master SAE.
+            slave_sae_id (str): ID of the slave SAE.
+
+        Returns:
+            int: the number of keys.
+        """
+        with self._lock:
+            return sum(
+                1
+                for master, slave, _ in self._keys.values()
+                if master == master_sae_id and slave == slave_sae_id
+            )
+
+    def _error(self, code: int, message: str) -> Tuple[int, dict]:
+        """Build an error response.
+
+        Args:
+            code (int): response code.
+            message (str): error message.
+
+        Returns:
+            (int, dict): the response code and data.
+        """
+        return code, {"message": message}
+
+    def _status(self, sae_id: str, slave_sae_id: str) -> Tuple[int, dict]:
+        """Answer a get status request.
+
+        Args:
+            sae_id (str): ID of the calling master SAE.
+            slave_sae_id (str): ID of the slave SAE.
+
+        Returns:
+            (int, dict): the response code and data.
+        """
+        return 200, {
+            "source_KME_ID": f"KME-{sae_id}",
+            "target_KME_ID": f"KME-{slave_sae_id}",
+            "master_SAE_ID": sae_id,
+            "slave_SAE_ID": slave_sae_id,
+            "key_size": self.key_size,
+            "stored_key_count": self.max_key_count - len(self._keys),
+            "max_key_count": self.max_key_count,
+            "max_key_per_request": self.max_key_per_request,
+            "max_key_size": self.max_key_size,
+            "min_key_size": self.min_key_size,
+            "max_SAE_ID_count": 0,
+        }
+
+    def _enc_keys(self, sae_id: str, slave_sae_id: str, data: dict) -> Tuple[int, dict]:
+        """Answer a get key request, storing the keys for the slave SAE.
+
+        Args:
+            sae_id (str): ID of the calling master SAE.
+            slave_sae_id (str): ID of the slave SAE.
+            data (dict): data of the request.
+
+        Returns:
+            (int, dict): the response code and data.
+        """
+        number = data.get("number", 1)
+        size = data.get("size", self.key_size)
+        if number < 1 or number > self.max_key_per_request:
+            return self._error(400, "Number of keys requested is not supported.")
+        if size % 8 != 0 or not self.min_key_size <= size <= self.max_key_size:
+            return self._error(400, "Size of the keys requested is not supported.")
+        if data.get("additional_slave_SAE_IDs"):
+            return self._error(400, "Key multicast is not supported.")
+
+        with self._lock:
+            if len(self._keys) + number > self.max_key_count:
+                return self._error(503, "Not enough keys available.")
+            keys = []
+            for _ in range(number):
+                key_id = str(uuid.uuid4())
+                key = base64.b64encode(os.urandom(size // 8)).decode()
+                self._keys[key_id] = (sae_id, slave_sae_id, key)
+                keys.append({"key_ID": key_id, "key": key})
+        return 200, {"keys": keys}
+
+    def _dec_keys(
+        self, sae_id: str, master_sae_id: str, data: dict
+    ) -> Tuple[int, dict]:
+        """Answer a get key with key IDs request, removing the keys from the store.
+
+        Args:
+            sae_id (str): ID of the calling slave SAE.
+            master_sae_id (str): ID of the master SAE.
+            data (dict): data of the request.
+
+        Returns:
+            (int, dict): the response code and data.
+        """
+        key_ids = [key_id["key_ID"] for key_id in data.get("key_IDs", [])]
+        with self._lock:
+            for key_id in key_ids:
+                if self._keys.get(key_id, (None, None))[:2] != (master_sae_id, sae_id):
+                    return self._error(400, f"Key {key_id} not found.")
+            keys = [
+                {"key_ID": key_id, "key": self._keys.pop(key_id)[2]}
+                for key_id in key_ids
+            ]
+        return 200, {"keys": keys}
+
+    def handle(
+        self, sae_id: str, method: str, url: str, data: dict = None
+    ) -> MockResponse:
+        """Answer a request of a SAE.
+
+        Args:
+            sae_id (str): ID of the calling SAE.
+            method (str): HTTP method.
+            url (str): target URL.
+            data (dict, optional): data of the request, for POST requests. Defaults to None.
+
+        Returns:
+            MockResponse: the response.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        match = _URL_PATTERN.match(url)
+        if match is None:
+            return MockResponse(*self._error(404, "Not found."))
+        target, command = match.groups()
+        if command == "status" and method == "GET":
+            return MockResponse(*self._status(sae_id, target))
+        if command == "enc_keys":
+            return MockResponse(*self._enc_keys(sae_id, target, data or {}))
+        if command == "dec_keys" and method == "POST":
+            return MockResponse(*self._dec_keys(sae_id, target, data or {}))
+        return MockResponse(*self._error(400, "Bad request format."))
+
+
+class MockTransport(QKD014Transport):
+    """
+    Transport sending the requests of a SAE to a MockKME.
+    """
+
+    def __init__(self, kme: MockKME, sae_id: str) -> None:
+        """Init the transport.
+
+        Args:
+            kme (MockKME): the mock KMEs.
+            sae_id (str): ID of the SAE using the transport.
+        """
+        super().__init__(None, None, None)
+        self.kme = kme
+        self.sae_id = sae_id
+
+    def get(self, url: str, span=NULL_SPAN, stream: bool = False) -> MockResponse:
+        """Make a GET request.
+
+        Args:
+            url (str): target URL.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): ignored, the body of the response is always available. Defaults to False.
+
+        Returns:
+            MockResponse: the response of the request.
+        """
+        response = self.kme.handle(self.sae_id, "GET", url)
+        span.mark("response_body")
+        return response
+
+    def post(
+        self, url: str, data: dict, span=NULL_SPAN, stream: bool = False
+    ) -> MockResponse:
+        """Make a POST request with a JSON body.
+
+        Args:
+            url (str): target URL.
+            data (dict): data of the request.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): ignored, the body of the response is always available. Defaults to False.
+
+        Returns:
+            MockResponse: the response of the request.
+        """
+        response = self.kme.handle(self.sae_id, "POST", url, data)
+        span.mark("response_body")
+        return response
+
+    def iter_content(
+        self, response: MockResponse, chunk_size: int = 65536
+    ) -> Iterator[bytes]:
+        """Iterate over the body of a response.
+
+        Args:
+            response (MockResponse): the response.
+            chunk_size (int, optional): maximum size of the chunks, in bytes. Defaults to 65536.
+
+        Yields:
+            bytes: the chunks of the body.
+        """
+        for start in range(0, len(response.content), chunk_size):
+            yield response.content[start : start + chunk_size]
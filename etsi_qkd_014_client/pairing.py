@@ -0,0 +1,284 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Paired master/slave sessions pipelining the key agreement between two SAEs.
+
+The MasterSession keeps several get key requests in flight and sends the key IDs
+of each batch to the slave SAE as soon as the batch is received. The SlaveSession
+requests the keys of each batch with the get key with key IDs command as soon as
+its key IDs are received, ahead of their consumption, and measures the end-to-end
+key agreement latency.
+
+The messages exchanged between the sessions are dicts that can be serialized in
+JSON, and are sent over a channel chosen by the application.
+"""
+
+import base64
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Callable, Iterator, Tuple
+
+from .client import QKD014Client
+from .data import QKD014Data
+from .pipeline import BatchPipeline
+
+
+class MasterSession:
+    """
+    Master side of a paired session.
+
+    Each message sent to the slave SAE holds the sequence number of the batch, the
+    IDs of its keys and the time at which the batch was requested, in nanoseconds
+    since the epoch. A message without key IDs is sent for a batch that could not
+    be obtained or that was cancelled, so that the slave SAE does not wait for it.
+    """
+
+    def __init__(
+        self,
+        client: QKD014Client,
+        slave_sae_id: str,
+        send: Callable[[dict], None],
+        size: int = None,
+        batch: int = 1,
+        depth: int = 2,
+        raw: bool = False,
+    ) -> None:
+        """Init the session.
+
+        Args:
+            client (QKD014Client): client of the master SAE.
+            slave_sae_id (str): URL-encoded SAE ID of slave SAE.
+            send (Callable[[dict], None]): function sending a message to the slave SAE. It is called by one thread at a time.
+            size (int, optional): Size of each key in bits, if None is given, server's default value is defined as key_size in Status data format. Defaults to None.
+            batch (int, optional): Number of keys requested in each request. Defaults to 1.
+            depth (int, optional): Number of requests kept in flight. Defaults to 2.
+            raw (bool, optional): If true, the keys are yielded as bytes instead of DataKey instances. Defaults to False.
+        """
+        self.client = client
+        self.slave_sae_id = slave_sae_id
+        self.send = send
+        self.size = size
+        self.batch = batch
+        self.depth = depth
+        self.raw = raw
+
+        self._send_lock = threading.Lock()
+        self._pipeline = BatchPipeline(self._fetch, depth, self._cancel)
+
+    def _send(self, sequence: int, key_ids: list[str], timestamp: int) -> None:
+        """Send the key IDs of a batch to the slave SAE.
+
+        Args:
+            sequence (int): sequence number of the batch.
+            key_ids (list[str]): IDs of the keys of the batch.
+            timestamp (int): time at which the batch was requested, in nanoseconds since the epoch.
+        """
+        with self._send_lock:
+            self.send(
+                {"sequence": sequence, "key_IDs": key_ids, "timestamp": timestamp}
+            )
+
+    def _fetch(self, sequence: int) -> list:
+        """Get a batch of keys and send their IDs to the slave SAE.
+
+        Args:
+            sequence (int): sequence number of the batch.
+
+        Raises:
+            Exception: if the request returns an error.
+
+        Returns:
+            list: the keys, as DataKey instances or bytes.
+        """
+        timestamp = time.time_ns()
+        try:
+            code, data = self.client.get_key(
+                self.slave_sae_id, number=self.batch, size=self.size
+            )
+        except Exception:
+            self._send(sequence, [], timestamp)
+            raise
+        if code != 200:
+            self._send(sequence, [], timestamp)
+            raise Exception(f"Could not get keys ({code}) : {data.message}")
+
+        self._send(sequence, [key.key_id for key in data.keys], timestamp)
+        return [base64.b64decode(key.key) if self.raw else key for key in data.keys]
+
+    def _cancel(self, sequence: int) -> None:
+        """Tell the slave SAE that a batch was cancelled before being requested.
+
+        Args:
+            sequence (int): sequence number of the batch.
+        """
+        self._send(sequence, [], time.time_ns())
+
+    def __iter__(self) -> Iterator:
+        """Iterate over an endless stream of keys shared with the slave SAE.
+
+        Up to depth batches are requested ahead of the consumption of the keys.
+        Closing the iterator cancels the requests that were not started yet. The
+        keys of the requests already in flight, whose IDs were sent to the slave
+        SAE, are kept and yielded first by the next iteration, so that both sides
+        always yield the same keys in the same order. The session must not be
+        iterated by several threads at the same time.
+
+        Raises:
+            Exception: if a request returns an error.
+
+        Yields:
+            DataKey or bytes: the keys.
+        """
+        yield from self._pipeline
+
+
+class SlaveSession:
+    """
+    Slave side of a paired session.
+
+    The messages of the master SAE are given to the feed method, in any order. The
+    keys of each batch are requested as soon as its message is received, with at
+    most depth requests in flight, and are yielded in the order of the batches of
+    the master SAE.
+    """
+
+    latencies: collections.deque  #: Key agreement latencies, in seconds.
+
+    def __init__(
+        self,
+        client: QKD014Client,
+        master_sae_id: str,
+        depth: int = 2,
+        timeout: float = None,
+        raw: bool = False,
+        history: int = 1024,
+    ) -> None:
+        """Init the session.
+
+        Args:
+            client (QKD014Client): client of the slave SAE.
+            master_sae_id (str): URL-encoded SAE ID of master SAE.
+            depth (int, optional): Number of requests kept in flight. Defaults to 2.
+            timeout (float, optional): maximum time to wait for the message of the next batch, in seconds. If None is given, there is no limit. Defaults to None.
+            raw (bool, optional): If true, the keys are yielded as bytes instead of DataKey instances. Defaults to False.
+            history (int, optional): number of latencies kept. Defaults to 1024.
+        """
+        self.client = client
+        self.master_sae_id = master_sae_id
+        self.depth = depth
+        self.timeout = timeout
+        self.raw = raw
+        self.latencies = collections.deque(maxlen=history)
+
+        self._batches = {}
+        self._next = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=depth)
+
+    def _resolve(self, key_ids: list[str], timestamp: int) -> Tuple[int, QKD014Data]:
+        """Get the keys of a batch and record the key agreement latency.
+
+        The latency is measured from the request of the batch by the master SAE,
+        so the clocks of the two SAEs should be synchronized.
+
+        Args:
+            key_ids (list[str]): IDs of the keys of the batch.
+            timestamp (int): time at which the batch was requested by the master SAE, in nanoseconds since the epoch.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        code, data = self.client.get_key_with_key_IDs(self.master_sae_id, key_ids)
+        if code == 200:
+            self.latencies.append((time.time_ns() - timestamp) / 1e9)
+        return code, data
+
+    def feed(self, message: dict) -> None:
+        """Receive a message of the master SAE and request the keys of its batch.
+
+        Args:
+            message (dict): the message.
+
+        Raises:
+            Exception: if the session is closed.
+        """
+        with self._condition:
+            if self._closed:
+                raise Exception("The session is closed.")
+            future = None
+            if message["key_IDs"]:
+                future = self._executor.submit(
+                    self._resolve, message["key_IDs"], message["timestamp"]
+                )
+            self._batches[message["sequence"]] = future
+            self._condition.notify_all()
+
+    def _next_batch(self) -> Tuple[bool, concurrent.futures.Future]:
+        """Wait for the message of the next batch.
+
+        Raises:
+            Exception: if the message is not received before the timeout.
+
+        Returns:
+            Tuple[bool, concurrent.futures.Future]: False if the session is closed, and the future of the keys of the batch (None if the batch has no key).
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._closed or self._next in self._batches, self.timeout
+            ):
+                raise Exception(f"Batch {self._next} was not received in time.")
+            if self._closed:
+                return False, None
+            future = self._batches.pop(self._next)
+            self._next += 1
+            return True, future
+
+    def __iter__(self) -> Iterator:
+        """Iterate over the keys shared with the master SAE, until the session is closed.
+
+        Raises:
+            Exception: if a request returns an error, or if the message of a batch is not received in time.
+
+        Yields:
+            DataKey or bytes: the keys.
+        """
+        while True:
+            running, future = self._next_batch()
+            if not running:
+                return
+            if future is None:
+                continue
+
+            code, data = future.result()
+            if code != 200:
+                raise Exception(f"Could not get keys ({code}) : {data.message}")
+            for key in data.keys:
+                yield base64.b64decode(key.key) if self.raw else key
+
+    def close(self) -> None:
+        """Close the session, cancelling the requests that were not started yet."""
+        with self._condition:
+            self._closed = True
+            for future in self._batches.values():
+                if future is not None:
+                    future.cancel()
+            self._batches.clear()
+            self._condition.notify_all()
+        self._executor.shutdown(wait=False)
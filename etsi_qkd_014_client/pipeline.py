@@ -0,0 +1,91 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pipeline of batch requests kept in flight ahead of the consumption of their items.
+
+It is used by the key streams of the client and by the master side of the
+paired sessions.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+from typing import Callable, Iterator
+
+
+class BatchPipeline:
+    """
+    Pipeline of batch requests.
+
+    Each batch is fetched by a call to fetch with the index of the batch, and up to
+    depth batches are fetched ahead of the consumption of their items. A new batch
+    is only requested when the items of a previous one have been consumed.
+
+    Closing an iterator over the pipeline cancels the batches that were not started
+    yet. The batches already started, and the items not consumed yet, are kept and
+    yielded first by the next iterator over the same pipeline.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[int], list],
+        depth: int = 2,
+        on_cancel: Callable[[int], None] = None,
+    ) -> None:
+        """Init the pipeline.
+
+        Args:
+            fetch (Callable[[int], list]): function fetching a batch from its index and returning its items. It is called in worker threads.
+            depth (int, optional): number of batches fetched at the same time. Defaults to 2.
+            on_cancel (Callable[[int], None], optional): function called with the index of each cancelled batch. Defaults to None.
+        """
+        self.fetch = fetch
+        self.depth = depth
+        self.on_cancel = on_cancel
+
+        self._indexes = itertools.count()
+        self._items = collections.deque()
+        self._pending = collections.deque()
+
+    def __iter__(self) -> Iterator:
+        """Iterate over the items of the batches, in the order of the batches.
+
+        An exception raised by fetch is raised when the items of its batch are
+        reached.
+
+        Yields:
+            the items of the batches.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.depth)
+        try:
+            while True:
+                while len(self._pending) < self.depth:
+                    index = next(self._indexes)
+                    self._pending.append((index, executor.submit(self.fetch, index)))
+
+                if not self._items:
+                    _, future = self._pending.popleft()
+                    self._items.extend(future.result())
+                    continue
+                yield self._items.popleft()
+        finally:
+            for index, future in list(self._pending):
+                if future.cancel():
+                    self._pending.remove((index, future))
+                    if self.on_cancel is not None:
+                        self.on_cancel(index)
+            executor.shutdown(wait=False)
@@ -0,0 +1,349 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Client side scheduling of the get key requests shared by several consumers.
+
+The number of keys requested for each slave SAE is limited by a token bucket,
+and the pending requests are served by priority class, then with weighted fair
+queuing between the slave SAEs, so that a single greedy consumer cannot drain
+the keys stored by the KME.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import threading
+import time
+from typing import Tuple
+
+from .client import QKD014Client
+from .data import QKD014Data
+
+PRIORITY_CONTROL = 0  #: Priority class of the control-plane keys, served first.
+PRIORITY_BULK = 1  #: Priority class of the bulk traffic.
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the number of keys requested per second.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """Init the bucket, full.
+
+        Args:
+            rate (float): number of tokens added per second.
+            burst (int): maximum number of tokens in the bucket.
+
+        Raises:
+            Exception: if the rate is not positive or the burst is lower than 1.
+        """
+        if rate <= 0 or burst < 1:
+            raise Exception(
+                f"Invalid token bucket (rate {rate}, burst {burst}): the rate must be positive and the burst at least 1."
+            )
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens accumulated since the last refill.
+
+        Args:
+            now (float): current monotonic time.
+        """
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self, tokens: int, now: float) -> float:
+        """Get the time to wait before the tokens can be consumed.
+
+        A request larger than the burst can be consumed when the bucket is full.
+
+        Args:
+            tokens (int): number of tokens.
+            now (float): current monotonic time.
+
+        Returns:
+            float: time to wait in seconds, 0 if the tokens can be consumed now.
+        """
+        self._refill(now)
+        needed = min(tokens, self.burst)
+        if self._tokens >= needed:
+            return 0
+        return (needed - self._tokens) / self.rate
+
+    def consume(self, tokens: int) -> None:
+        """Consume tokens. The number of tokens can become negative.
+
+        Args:
+            tokens (int): number of tokens.
+        """
+        self._tokens -= tokens
+
+
+class _PendingRequest:
+    """
+    Get key request waiting in the scheduler.
+    """
+
+    def __init__(
+        self,
+        slave_sae_id: str,
+        priority: int,
+        cost: int,
+        kwargs: dict,
+        sequence: int,
+    ) -> None:
+        """Init the request.
+
+        Args:
+            slave_sae_id (str): ID of the slave SAE.
+            priority (int): priority class of the request.
+            cost (int): number of keys requested.
+            kwargs (dict): arguments of the get key command.
+            sequence (int): arrival order of the request.
+        """
+        self.slave_sae_id = slave_sae_id
+        self.priority = priority
+        self.cost = cost
+        self.kwargs = kwargs
+        self.sequence = sequence
+        self.start_tag = 0
+        self.finish_tag = 0
+        self.future = concurrent.futures.Future()
+
+
+class KeyScheduler:
+    """
+    Scheduler of the get key requests of several consumers.
+
+    Requests are dispatched to the client by a background thread, at most
+    max_in_flight at a time. Among the pending requests whose slave SAE has
+    enough tokens, the one with the lowest priority class is chosen first, then
+    the one with the lowest virtual finish time (weighted fair queuing between
+    the slave SAEs, the cost of a request being its number of keys).
+    """
+
+    def __init__(
+        self,
+        client: QKD014Client,
+        rates: dict = None,
+        default_rate: Tuple[float, int] = None,
+        weights: dict = None,
+        max_in_flight: int = 1,
+    ) -> None:
+        """Init the scheduler and start its dispatching thread.
+
+        Args:
+            client (QKD014Client): client used to get the keys from the KME.
+            rates (dict, optional): token bucket parameters (rate in keys per second, burst in keys) for each slave SAE ID. Defaults to None.
+            default_rate (Tuple[float, int], optional): token bucket parameters for the slave SAEs that are not in rates. If None is given, they are not rate limited. Defaults to None.
+            weights (dict, optional): weight of each slave SAE ID for the fair queuing. The default weight is 1. Defaults to None.
+            max_in_flight (int, optional): maximum number of requests made to the KME at the same time. Defaults to 1.
+
+        Raises:
+            Exception: if a rate is invalid.
+        """
+        # Check the rates now rather than in the dispatching thread.
+        for rate in list((rates or {}).values()) + [default_rate]:
+            if rate:
+                TokenBucket(*rate)
+
+        self.client = client
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.weights = weights or {}
+        self.max_in_flight = max_in_flight
+
+        self._buckets = {}
+        self._queues = collections.defaultdict(collections.deque)
+        self._last_finish = collections.defaultdict(float)
+        self._virtual_time = 0
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_in_flight
+        )
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def _get_bucket(self, slave_sae_id: str) -> TokenBucket:
+        """Get the token bucket of a slave SAE.
+
+        Args:
+            slave_sae_id (str): ID of the slave SAE.
+
+        Returns:
+            TokenBucket: the bucket, or None if the slave SAE is not rate limited.
+        """
+        if slave_sae_id not in self._buckets:
+            rate = self.rates.get(slave_sae_id, self.default_rate)
+            self._buckets[slave_sae_id] = TokenBucket(*rate) if rate else None
+        return self._buckets[slave_sae_id]
+
+    def submit(
+        self, slave_sae_id: str, priority: int = PRIORITY_BULK, **kwargs
+    ) -> concurrent.futures.Future:
+        """Submit a get key request.
+
+        Args:
+            slave_sae_id (str): ID of the slave SAE.
+            priority (int, optional): priority class of the request, lower classes being served first. Defaults to PRIORITY_BULK.
+            kwargs: other arguments of the get key command of the client.
+
+        Raises:
+            Exception: if the scheduler is closed.
+
+        Returns:
+            concurrent.futures.Future: future of the (int, QKD014Data) tuple returned by the client. It can be cancelled while the request is pending.
+        """
+        cost = kwargs.get("number") or 1
+        with self._condition:
+            if self._closed:
+                raise Exception("The scheduler is closed.")
+
+            request = _PendingRequest(
+                slave_sae_id, priority, cost, kwargs, next(self._sequence)
+            )
+            request.start_tag = max(self._virtual_time, self._last_finish[slave_sae_id])
+            request.finish_tag = request.start_tag + cost / self.weights.get(
+                slave_sae_id, 1
+            )
+            self._last_finish[slave_sae_id] = request.finish_tag
+            self._queues[(priority, slave_sae_id)].append(request)
+            self._condition.notify()
+        return request.future
+
+    def get_key(
+        self, slave_sae_id: str, priority: int = PRIORITY_BULK, **kwargs
+    ) -> Tuple[int, QKD014Data]:
+        """Get key command, going through the scheduler.
+
+        Args:
+            slave_sae_id (str): ID of the slave SAE.
+            priority (int, optional): priority class of the request, lower classes being served first. Defaults to PRIORITY_BULK.
+            kwargs: other arguments of the get key command of the client.
+
+        Returns:
+            (int, QKD014Data): The response code and DataKeyContainer or DataError.
+        """
+        return self.submit(slave_sae_id, priority, **kwargs).result()
+
+    def _fail(self, queue: collections.deque, exc: Exception) -> None:
+        """Fail all the requests of a queue, that cannot be scheduled.
+
+        Args:
+            queue (collections.deque): the queue.
+            exc (Exception): the exception set on the futures of the requests.
+        """
+        while queue:
+            request = queue.popleft()
+            if request.future.set_running_or_notify_cancel():
+                request.future.set_exception(exc)
+
+    def _select(self, now: float) -> Tuple[_PendingRequest, float]:
+        """Select the next request to dispatch and remove it from its queue.
+
+        Args:
+            now (float): current monotonic time.
+
+        Returns:
+            Tuple[_PendingRequest, float]: the request, or None if no request can be dispatched now, and the time to wait before a request can be dispatched (None if there is no pending request).
+        """
+        best = None
+        wait = None
+        for queue_key, queue in self._queues.items():
+            while queue and queue[0].future.cancelled():
+                queue.popleft()
+            if not queue:
+                continue
+
+            request = queue[0]
+            try:
+                bucket = self._get_bucket(request.slave_sae_id)
+                delay = bucket.delay(request.cost, now) if bucket is not None else 0
+            except Exception as exc:  # pylint: disable=broad-except
+                self._fail(queue, exc)
+                continue
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            order = (request.priority, request.finish_tag, request.sequence)
+            if best is None or order < best[0]:
+                best = (order, queue_key)
+
+        if best is None:
+            return None, wait
+
+        request = self._queues[best[1]].popleft()
+        bucket = self._get_bucket(request.slave_sae_id)
+        if bucket is not None:
+            bucket.consume(request.cost)
+        self._virtual_time = request.start_tag
+        return request, 0
+
+    def _run(self, request: _PendingRequest) -> None:
+        """Make the request with the client and set the result of its future.
+
+        Args:
+            request (_PendingRequest): the request.
+        """
+        try:
+            result = self.client.get_key(request.slave_sae_id, **request.kwargs)
+        except Exception as exc:  # pylint: disable=broad-except
+            request.future.set_exception(exc)
+        else:
+            request.future.set_result(result)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def _dispatch(self) -> None:
+        """Dispatch the pending requests to the client until the scheduler is closed."""
+        with self._condition:
+            while not self._closed:
+                if self._in_flight >= self.max_in_flight:
+                    self._condition.wait()
+                    continue
+
+                request, wait = self._select(time.monotonic())
+                if request is None:
+                    self._condition.wait(wait)
+                    continue
+
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                self._in_flight += 1
+                self._executor.submit(self._run, request)
+
+    def close(self) -> None:
+        """Stop the scheduler, cancelling the pending requests."""
+        with self._condition:
+            self._closed = True
+            for queue in self._queues.values():
+                for request in queue:
+                    request.future.cancel()
+                queue.clear()
+            self._condition.notify_all()
+        self._thread.join()
+        self._executor.shutdown()
@@ -0,0 +1,253 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process-wide cache of the SSL contexts used to connect to the KMEs.
+
+Loading the certificate, the key and the root CA is done once per set of files
+and shared by all the clients of the process. The files are checked on each
+lookup, so that a new context is created when a certificate is rotated.
+
+The HTTP libraries set the ALPN protocols of the context before each connection,
+so the transports negotiating different protocols (HTTP/1.1 only, or HTTP/2 and
+HTTP/1.1) never share a context.
+
+The contexts also remember the TLS sessions negotiated with each KME, so that
+new connections made by any client sharing the context resume the session
+instead of doing a full handshake.
+"""
+
+import os
+import ssl
+import threading
+import weakref
+from typing import Tuple
+
+from .tracing import get_current_span
+
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+
+class _ResumingSSLSocket(ssl.SSLSocket):
+    """
+    SSL socket giving its TLS session back to its context when it is closed.
+    """
+
+    def _real_close(self) -> None:
+        """Save the TLS session in the context and close the socket."""
+        if isinstance(self.context, ResumingSSLContext) and not self.server_side:
+            self.context._save_session(self.server_hostname, self)
+        super()._real_close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    Client SSL context resuming the TLS sessions previously negotiated with a server.
+
+    The last socket opened to each server is remembered. Its session is read when
+    a new connection is made to the same server, or when it is closed, which allows
+    to also catch the session tickets sent by TLS 1.3 servers after the handshake.
+    """
+
+    sslsocket_class = _ResumingSSLSocket
+
+    def __init__(self, protocol: int = ssl.PROTOCOL_TLS_CLIENT) -> None:
+        """Init the context.
+
+        Args:
+            protocol (int, optional): SSL protocol of the context. Defaults to ssl.PROTOCOL_TLS_CLIENT.
+        """
+        # The protocol is handled by ssl.SSLContext.__new__.
+        super().__init__()
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+
+    def _get_session(self, server_hostname: str) -> ssl.SSLSession:
+        """Get the last TLS session negotiated with a server.
+
+        Args:
+            server_hostname (str): hostname of the server.
+
+        Returns:
+            ssl.SSLSession: the session, or None if no session can be resumed.
+        """
+        with self._sessions_lock:
+            entry = self._sessions.get(server_hostname)
+            if entry is None:
+                return None
+            sock_ref, session = entry
+            sock = sock_ref()
+            if sock is not None and sock.session is not None:
+                session = sock.session
+                self._sessions[server_hostname] = (sock_ref, session)
+            return session
+
+    def _save_session(self, server_hostname: str, ssl_sock: ssl.SSLSocket) -> None:
+        """Save the TLS session of a socket as the last one negotiated with a server.
+
+        Args:
+            server_hostname (str): hostname of the server.
+            ssl_sock (ssl.SSLSocket): socket connected to the server.
+        """
+        session = ssl_sock.session
+        if session is None:
+            return
+        with self._sessions_lock:
+            entry = self._sessions.get(server_hostname)
+            # Only the last opened socket can update the session.
+            if entry is not None and entry[0]() is ssl_sock:
+                self._sessions[server_hostname] = (entry[0], session)
+
+    def wrap_socket(
+        self,
+        sock,
+        server_side=False,
+        do_handshake_on_connect=True,
+        suppress_ragged_eofs=True,
+        server_hostname=None,
+        session=None,
+    ):
+        """Wrap a socket, resuming the last TLS session negotiated with the server if possible.
+
+        The arguments are the ones of ssl.SSLContext.wrap_socket.
+
+        Returns:
+            ssl.SSLSocket: the wrapped socket.
+        """
+        if session is None and not server_side:
+            session = self._get_session(server_hostname)
+
+        span = get_current_span()
+        span.mark("connect")
+        ssl_sock = super().wrap_socket(
+            sock,
+            server_side=server_side,
+            do_handshake_on_connect=do_handshake_on_connect,
+            suppress_ragged_eofs=suppress_ragged_eofs,
+            server_hostname=server_hostname,
+            session=session,
+        )
+        span.mark("tls_handshake")
+
+        if not server_side:
+            with self._sessions_lock:
+                self._sessions[server_hostname] = (
+                    weakref.ref(ssl_sock),
+                    ssl_sock.session or session,
+                )
+        return ssl_sock
+
+
+def _files_stamp(*paths: str) -> Tuple:
+    """Return a stamp of the files that changes when one of them is modified.
+
+    Args:
+        paths (str): paths of the files. None values are ignored.
+
+    Returns:
+        Tuple: the stamp of the files.
+    """
+    stamp = []
+    for path in paths:
+        if path is None:
+            stamp.append(None)
+            continue
+        stat = os.stat(path)
+        stamp.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return tuple(stamp)
+
+
+def create_ssl_context(
+    cert_path: str,
+    key_path: str,
+    ca_path: str,
+    force_insecure: bool = False,
+    alpn_protocols: Tuple[str, ...] = None,
+) -> ResumingSSLContext:
+    """Create a new SSL context for mutual TLS with a KME.
+
+    Args:
+        cert_path (str): path of the certificate file for the client. If None is given, no client certificate is sent.
+        key_path (str): path of the secret key associated to the certificate of the client.
+        ca_path (str): path of the root CA that will be used to check the autenticity of the certificate of the server. If None is given, the default trust store of the system is used.
+        force_insecure (bool, optional): If true, the context will not proceed to the authenticity verification of the server. Defaults to False.
+        alpn_protocols (Tuple[str, ...], optional): protocols advertised with ALPN. Defaults to None.
+
+    Returns:
+        ResumingSSLContext: the SSL context.
+    """
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    if force_insecure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif ca_path is None:
+        context.load_default_certs()
+    else:
+        context.load_verify_locations(cafile=ca_path)
+    if cert_path is not None:
+        context.load_cert_chain(cert_path, key_path)
+    if alpn_protocols:
+        context.set_alpn_protocols(list(alpn_protocols))
+    return context
+
+
+def get_ssl_context(
+    cert_path: str,
+    key_path: str,
+    ca_path: str,
+    force_insecure: bool = False,
+    alpn_protocols: Tuple[str, ...] = None,
+) -> ResumingSSLContext:
+    """Get the SSL context for a set of TLS parameters from the process-wide cache.
+
+    The context is created on the first call, and created again if one of the files
+    was modified since. Each set of ALPN protocols gets its own context.
+
+    Args:
+        cert_path (str): path of the certificate file for the client. If None is given, no client certificate is sent.
+        key_path (str): path of the secret key associated to the certificate of the client.
+        ca_path (str): path of the root CA that will be used to check the autenticity of the certificate of the server. If None is given, the default trust store of the system is used.
+        force_insecure (bool, optional): If true, the context will not proceed to the authenticity verification of the server. Defaults to False.
+        alpn_protocols (Tuple[str, ...], optional): protocols advertised with ALPN. Defaults to None.
+
+    Returns:
+        ResumingSSLContext: the SSL context.
+    """
+    if force_insecure:
+        ca_path = None
+    cache_key = tuple(
+        os.path.abspath(path) if path is not None else None
+        for path in (cert_path, key_path, ca_path)
+    ) + (force_insecure, tuple(alpn_protocols or ()))
+    stamp = _files_stamp(cert_path, key_path, ca_path)
+
+    with _ssl_contexts_lock:
+        entry = _ssl_contexts.get(cache_key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        context = create_ssl_context(
+            cert_path, key_path, ca_path, force_insecure, alpn_protocols
+        )
+        _ssl_contexts[cache_key] = (stamp, context)
+        return context
+
+
+def clear_ssl_context_cache() -> None:
+    """Remove all the SSL contexts from the process-wide cache."""
+    with _ssl_contexts_lock:
+        _ssl_contexts.clear()
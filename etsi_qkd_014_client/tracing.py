@@ -0,0 +1,280 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Span based tracing of the requests made by the client.
+
+Each call to a method of the client creates a span, in which the end of each
+phase of the request is marked:
+
+* ``connect``: name resolution and TCP connection (only for new connections);
+* ``tls_handshake``: TLS handshake (only for new connections);
+* ``response_headers``: request sent and response headers received;
+* ``response_body``: response body received;
+* ``json_decode``: response body decoded;
+* ``data``: data instance built from the decoded response.
+
+When no tracer is given to the client, the NULL_SPAN is used, whose methods
+do nothing.
+"""
+
+import abc
+import collections
+import threading
+import time
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover
+    otel_trace = None
+
+_local = threading.local()
+
+
+class Span:
+    """
+    Span of a request made by the client.
+
+    Timestamps are in nanoseconds since the epoch, as in OpenTelemetry. They are
+    computed from a monotonic clock, so that durations are precise.
+    """
+
+    name: str  #: Name of the span (name of the method of the client).
+    attributes: dict  #: Attributes of the span.
+    start_time: int  #: Start of the span, in nanoseconds since the epoch.
+    end_time: int  #: End of the span, in nanoseconds since the epoch. None while the span is not ended.
+    events: list  #: List of (phase, timestamp) marking the end of each phase.
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict = None) -> None:
+        """Init and start the span.
+
+        Args:
+            tracer (Tracer): tracer to which the span is exported when it ends.
+            name (str): name of the span.
+            attributes (dict, optional): attributes of the span. Defaults to None.
+        """
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes or {}
+        self.events = []
+        self.end_time = None
+        self._perf_start = time.perf_counter_ns()
+        self.start_time = time.time_ns()
+
+    def now(self) -> int:
+        """Get the current time.
+
+        Returns:
+            int: current time, in nanoseconds since the epoch.
+        """
+        return self.start_time + time.perf_counter_ns() - self._perf_start
+
+    def mark(self, phase: str, timestamp: int = None) -> None:
+        """Mark the end of a phase.
+
+        Args:
+            phase (str): name of the phase.
+            timestamp (int, optional): end of the phase, in nanoseconds since the epoch. If None is given, the current time is used. Defaults to None.
+        """
+        self.events.append((phase, timestamp or self.now()))
+
+    def set_attribute(self, key: str, value: object) -> None:
+        """Set an attribute of the span.
+
+        Args:
+            key (str): name of the attribute.
+            value (object): value of the attribute.
+        """
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        """End the span and export it."""
+        self.end_time = self.now()
+        self.tracer.export(self)
+
+    def durations(self) -> dict:
+        """Get the duration of each phase.
+
+        Returns:
+            dict: duration of each phase, in nanoseconds.
+        """
+        res = {}
+        previous = self.start_time
+        for phase, timestamp in self.events:
+            res[phase] = timestamp - previous
+            previous = timestamp
+        return res
+
+    def to_dict(self) -> dict:
+        """Get a dict representation of the span, using the field names of OpenTelemetry.
+
+        Returns:
+            dict: the span.
+        """
+        return {
+            "name": self.name,
+            "start_time_unix_nano": self.start_time,
+            "end_time_unix_nano": self.end_time,
+            "attributes": dict(self.attributes),
+            "events": [
+                {"name": phase, "time_unix_nano": timestamp}
+                for phase, timestamp in self.events
+            ],
+        }
+
+    def __str__(self) -> str:
+        """String representation of the instance.
+
+        Returns:
+            str: String representation of the instance.
+        """
+        res = f"{self.name} {self.attributes}\n"
+        for phase, duration in self.durations().items():
+            res += f"\t {phase} : {duration / 1e6:.3f} ms\n"
+        if self.end_time is not None:
+            res += f"\t total : {(self.end_time - self.start_time) / 1e6:.3f} ms\n"
+        return res
+
+
+class _NullSpan:
+    """
+    Span used when tracing is disabled. All its methods do nothing.
+    """
+
+    def mark(self, phase: str, timestamp: int = None) -> None:
+        """Do nothing."""
+
+    def set_attribute(self, key: str, value: object) -> None:
+        """Do nothing."""
+
+    def end(self) -> None:
+        """Do nothing."""
+
+
+NULL_SPAN = _NullSpan()
+
+
+def get_current_span():
+    """Get the span of the request being made by the current thread.
+
+    This is used to mark the phases of the connection, that happen below the transport.
+
+    Returns:
+        Span: the current span, or NULL_SPAN if there is none.
+    """
+    return getattr(_local, "span", NULL_SPAN)
+
+
+def set_current_span(span) -> None:
+    """Set the span of the request being made by the current thread.
+
+    Args:
+        span (Span): the current span, or NULL_SPAN.
+    """
+    _local.span = span
+
+
+class Tracer(abc.ABC):
+    """
+    Abstract tracer class.
+    """
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Start a new span.
+
+        Args:
+            name (str): name of the span.
+
+        Returns:
+            Span: the span.
+        """
+        return Span(self, name, attributes)
+
+    @abc.abstractmethod
+    def export(self, span: Span) -> None:
+        """Export an ended span.
+
+        Args:
+            span (Span): the span.
+        """
+
+
+class RingBufferTracer(Tracer):
+    """
+    Tracer keeping the last spans in memory.
+    """
+
+    def __init__(self, size: int = 1024) -> None:
+        """Init the tracer.
+
+        Args:
+            size (int, optional): maximum number of spans to keep. Defaults to 1024.
+        """
+        self.spans = collections.deque(maxlen=size)
+
+    def export(self, span: Span) -> None:
+        """Add the span to the buffer, removing the oldest one if the buffer is full.
+
+        Args:
+            span (Span): the span.
+        """
+        self.spans.append(span)
+
+    def clear(self) -> None:
+        """Remove all the spans from the buffer."""
+        self.spans.clear()
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Tracer exporting the spans to OpenTelemetry.
+
+    Each phase is exported as an event of the span. This requires the optional
+    ``opentelemetry-api`` dependency, installed with the ``otel`` extra, and an
+    OpenTelemetry SDK to be configured to actually export the spans.
+    """
+
+    def __init__(self, tracer_provider=None) -> None:
+        """Init the tracer.
+
+        Args:
+            tracer_provider (opentelemetry.trace.TracerProvider, optional): tracer provider to use. If None is given, the global tracer provider is used. Defaults to None.
+
+        Raises:
+            Exception: if opentelemetry is not installed.
+        """
+        if otel_trace is None:
+            raise Exception(
+                "The OpenTelemetry tracer requires opentelemetry. Install it with pip install etsi-qkd-014-client[otel]."
+            )
+        self.otel_tracer = otel_trace.get_tracer(
+            "etsi_qkd_014_client", tracer_provider=tracer_provider
+        )
+
+    def export(self, span: Span) -> None:
+        """Export the span to OpenTelemetry.
+
+        Args:
+            span (Span): the span.
+        """
+        otel_span = self.otel_tracer.start_span(
+            span.name,
+            start_time=span.start_time,
+            attributes=span.attributes,
+        )
+        for phase, timestamp in span.events:
+            otel_span.add_event(phase, timestamp=timestamp)
+        otel_span.end(end_time=span.end_time)
@@ -0,0 +1,516 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Transports used by the client to exchange HTTP requests with the KME.
+
+A transport holds the mutual TLS configuration and the connections to the KME.
+The client only relies on the returned responses having a ``status_code``
+attribute and a ``json()`` method. The body of streamed responses is read
+incrementally with the ``iter_content`` method of the transport.
+"""
+
+import abc
+import ssl
+import threading
+from typing import Iterator, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+from .tls import get_ssl_context
+from .tracing import NULL_SPAN, set_current_span
+
+# Phases of the tracing corresponding to the trace events of httpx.
+_HTTPX_PHASES = {
+    "connect_tcp.complete": "connect",
+    "start_tls.complete": "tls_handshake",
+    "receive_response_headers.complete": "response_headers",
+    "receive_response_body.complete": "response_body",
+}
+
+
+class QKD014Transport(abc.ABC):
+    """
+    Abstract transport class for QKD014.
+
+    The SSL context is only loaded on the first request, so that a transport can be
+    created before the certificate files exist.
+    """
+
+    alpn_protocols: Tuple[str, ...] = None  #: Protocols advertised with ALPN.
+
+    def __init__(
+        self,
+        cert_path: str,
+        key_path: str,
+        ca_path: str,
+        force_insecure: bool = False,
+        timeout: float = 10,
+    ) -> None:
+        """Init the transport.
+
+        Args:
+            cert_path (str): path of the certificate file for the client.
+            key_path (str): path of the secret key associated to the certificate of the client.
+            ca_path (str): path of the root CA that will be used to check the autenticity of the certificate of the server. If None is given, the default trust store of the system is used.
+            force_insecure (bool, optional): If true, the transport will not proceed to the authenticity verification of the server. Defaults to False.
+            timeout (float, optional): timeout of the requests, in seconds. Defaults to 10.
+        """
+        self.cert_path = cert_path
+        self.key_path = key_path
+        self.ca_path = ca_path
+        self.force_insecure = force_insecure
+        self.timeout = timeout
+
+    @abc.abstractmethod
+    def get(self, url: str, span=NULL_SPAN, stream: bool = False):
+        """Make a GET request.
+
+        Args:
+            url (str): target URL.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of a successful response is not read, and should be read with iter_content. Defaults to False.
+
+        Returns:
+            the response of the request.
+        """
+
+    @abc.abstractmethod
+    def post(self, url: str, data: dict, span=NULL_SPAN, stream: bool = False):
+        """Make a POST request with a JSON body.
+
+        Args:
+            url (str): target URL.
+            data (dict): data of the request.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of a successful response is not read, and should be read with iter_content. Defaults to False.
+
+        Returns:
+            the response of the request.
+        """
+
+    @abc.abstractmethod
+    def iter_content(self, response, chunk_size: int = 65536) -> Iterator[bytes]:
+        """Iterate over the body of a streamed response, and close it at the end.
+
+        Args:
+            response: the streamed response.
+            chunk_size (int, optional): maximum size of the chunks, in bytes. Defaults to 65536.
+
+        Yields:
+            bytes: the chunks of the body.
+        """
+
+    def _get_ssl_context(self) -> ssl.SSLContext:
+        """Get the SSL context of the transport from the process-wide cache.
+
+        Returns:
+            ssl.SSLContext: the SSL context.
+        """
+        return get_ssl_context(
+            self.cert_path,
+            self.key_path,
+            self.ca_path,
+            self.force_insecure,
+            self.alpn_protocols,
+        )
+
+    def close(self) -> None:
+        """Close the connections held by the transport."""
+
+
+class _SSLContextAdapter(HTTPAdapter):
+    """
+    Adapter for requests using a given SSL context.
+
+    The verify and cert arguments of the requests are ignored, since the
+    TLS configuration is already held by the SSL context.
+    """
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs) -> None:
+        """Init the adapter.
+
+        Args:
+            ssl_context (ssl.SSLContext): SSL context to use for the connections.
+        """
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        """Init the pool manager with the SSL context of the adapter."""
+        kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs) -> requests.Response:
+        """Send a request.
+
+        The verify and cert arguments are overridden, since they could point to
+        other files through the REQUESTS_CA_BUNDLE environment variable.
+
+        Returns:
+            requests.Response: the response of the request.
+        """
+        kwargs["verify"] = self.ssl_context.verify_mode != ssl.CERT_NONE
+        kwargs["cert"] = None
+        return super().send(request, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert) -> None:
+        """Set the verification mode of the connection without loading any file."""
+        conn.cert_reqs = "CERT_REQUIRED" if verify else "CERT_NONE"
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
+
+
+class RequestsTransport(QKD014Transport):
+    """
+    HTTP/1.1 transport based on requests.
+
+    Connections are kept alive in a session and reused between requests. The SSL
+    context is shared with the other transports using the same TLS parameters.
+    """
+
+    alpn_protocols = ("http/1.1",)
+
+    def __init__(
+        self,
+        cert_path: str,
+        key_path: str,
+        ca_path: str,
+        force_insecure: bool = False,
+        timeout: float = 10,
+    ) -> None:
+        """Init the transport.
+
+        Args:
+            cert_path (str): path of the certificate file for the client.
+            key_path (str): path of the secret key associated to the certificate of the client.
+            ca_path (str): path of the root CA that will be used to check the autenticity of the certificate of the server. If None is given, the default trust store of the system is used.
+            force_insecure (bool, optional): If true, the transport will not proceed to the authenticity verification of the server. Defaults to False.
+            timeout (float, optional): timeout of the requests, in seconds. Defaults to 10.
+        """
+        super().__init__(cert_path, key_path, ca_path, force_insecure, timeout)
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self.ssl_context = None
+
+    def _refresh_ssl_context(self) -> None:
+        """Mount a new adapter if the SSL context changed since the last request.
+
+        The previous adapter is closed right away. The requests still in flight
+        through it keep their connections, which are closed when they are released
+        instead of being returned to its pools.
+        """
+        ssl_context = self._get_ssl_context()
+        if ssl_context is self.ssl_context:
+            return
+
+        with self._lock:
+            if ssl_context is not self.ssl_context:
+                previous = self.session.get_adapter("https://")
+                self.session.mount("https://", _SSLContextAdapter(ssl_context))
+                self.ssl_context = ssl_context
+                previous.close()
+
+    def _request(
+        self, method: str, url: str, span, stream: bool, **kwargs
+    ) -> requests.Response:
+        """Make a request, marking its phases in the span.
+
+        The connect and tls_handshake phases are marked by the SSL context, through
+        the current span of the thread. The end of the response_headers phase is
+        computed from the elapsed time measured by requests.
+
+        Args:
+            method (str): HTTP method.
+            url (str): target URL.
+            span (Span): span in which the phases of the request are marked.
+            stream (bool): If true, the body of the response is not read.
+
+        Returns:
+            requests.Response: the response of the request.
+        """
+        self._refresh_ssl_context()
+        if span is NULL_SPAN:
+            return self.session.request(
+                method, url, timeout=self.timeout, stream=stream, **kwargs
+            )
+
+        start = span.now()
+        set_current_span(span)
+        try:
+            response = self.session.request(
+                method, url, timeout=self.timeout, stream=stream, **kwargs
+            )
+        finally:
+            set_current_span(NULL_SPAN)
+        span.mark(
+            "response_headers", start + int(response.elapsed.total_seconds() * 1e9)
+        )
+        if not stream:
+            span.mark("response_body")
+        return response
+
+    def get(self, url: str, span=NULL_SPAN, stream: bool = False) -> requests.Response:
+        """Make a GET request.
+
+        Args:
+            url (str): target URL.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of the response is not read, and should be read with iter_content. Defaults to False.
+
+        Returns:
+            requests.Response: the response of the request.
+        """
+        return self._request("GET", url, span, stream)
+
+    def post(
+        self, url: str, data: dict, span=NULL_SPAN, stream: bool = False
+    ) -> requests.Response:
+        """Make a POST request with a JSON body.
+
+        Args:
+            url (str): target URL.
+            data (dict): data of the request.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of the response is not read, and should be read with iter_content. Defaults to False.
+
+        Returns:
+            requests.Response: the response of the request.
+        """
+        return self._request("POST", url, span, stream, json=data)
+
+    def iter_content(
+        self, response: requests.Response, chunk_size: int = 65536
+    ) -> Iterator[bytes]:
+        """Iterate over the body of a streamed response, and close it at the end.
+
+        Args:
+            response (requests.Response): the streamed response.
+            chunk_size (int, optional): maximum size of the chunks, in bytes. Defaults to 65536.
+
+        Yields:
+            bytes: the chunks of the body.
+        """
+        try:
+            yield from response.iter_content(chunk_size)
+        finally:
+            response.close()
+
+    def close(self) -> None:
+        """Close the connections held by the transport."""
+        self.session.close()
+
+
+class HTTP2Transport(QKD014Transport):
+    """
+    HTTP/2 transport based on httpx.
+
+    HTTP/2 is negotiated with the KME using ALPN. When it is accepted, all the
+    concurrent requests made through this transport are multiplexed over a single
+    mutual TLS connection. When the KME only speaks HTTP/1.1, the transport falls
+    back to HTTP/1.1 with keep-alive connections. The SSL context is shared with
+    the other transports using the same TLS parameters.
+
+    This requires the optional ``httpx`` dependency with HTTP/2 support, installed
+    with the ``http2`` extra (``pip install etsi-qkd-014-client[http2]``).
+    """
+
+    alpn_protocols = ("h2", "http/1.1")
+
+    def __init__(
+        self,
+        cert_path: str,
+        key_path: str,
+        ca_path: str,
+        force_insecure: bool = False,
+        timeout: float = 10,
+    ) -> None:
+        """Init the transport.
+
+        Args:
+            cert_path (str): path of the certificate file for the client.
+            key_path (str): path of the secret key associated to the certificate of the client.
+            ca_path (str): path of the root CA that will be used to check the autenticity of the certificate of the server. If None is given, the default trust store of the system is used.
+            force_insecure (bool, optional): If true, the transport will not proceed to the authenticity verification of the server. Defaults to False.
+            timeout (float, optional): timeout of the requests, in seconds. Defaults to 10.
+
+        Raises:
+            Exception: if httpx is not installed.
+        """
+        if httpx is None:
+            raise Exception(
+                "The HTTP/2 transport requires httpx. Install it with pip install etsi-qkd-014-client[http2]."
+            )
+        super().__init__(cert_path, key_path, ca_path, force_insecure, timeout)
+        self._lock = threading.Lock()
+        self.ssl_context = None
+        self.client = None
+        self._in_flight = {}
+        self._streams = {}
+
+    def _acquire(self) -> "httpx.Client":
+        """Get the httpx client for a new request.
+
+        A new client is created if the SSL context changed since the last request.
+        The previous client is closed once the requests in flight through it are
+        done, since closing it also closes the connections they use.
+
+        Returns:
+            httpx.Client: the client, to give back to _release at the end of the request.
+        """
+        ssl_context = self._get_ssl_context()
+        with self._lock:
+            if ssl_context is not self.ssl_context:
+                previous = self.client
+                self.client = httpx.Client(
+                    http2=True, verify=ssl_context, timeout=self.timeout
+                )
+                self.ssl_context = ssl_context
+                if previous is not None and previous not in self._in_flight:
+                    previous.close()
+            self._in_flight[self.client] = self._in_flight.get(self.client, 0) + 1
+            return self.client
+
+    def _release(self, client: "httpx.Client") -> None:
+        """Mark the end of a request, closing its client if it was replaced.
+
+        Args:
+            client (httpx.Client): the client given by _acquire.
+        """
+        with self._lock:
+            if client not in self._in_flight:
+                return
+            self._in_flight[client] -= 1
+            if self._in_flight[client]:
+                return
+            del self._in_flight[client]
+            if client is not self.client:
+                client.close()
+
+    def _request(
+        self, method: str, url: str, span, stream: bool, **kwargs
+    ) -> "httpx.Response":
+        """Make a request, marking its phases in the span.
+
+        The phases are marked from the trace events of httpx.
+
+        Args:
+            method (str): HTTP method.
+            url (str): target URL.
+            span (Span): span in which the phases of the request are marked.
+            stream (bool): If true, the body of a successful response is not read.
+
+        Returns:
+            httpx.Response: the response of the request.
+        """
+        client = self._acquire()
+        try:
+            if span is NULL_SPAN and not stream:
+                return client.request(method, url, **kwargs)
+
+            extensions = {}
+            if span is not NULL_SPAN:
+
+                def trace(event_name: str, info: dict) -> None:
+                    phase = _HTTPX_PHASES.get(event_name.split(".", 1)[1])
+                    # The body of a streamed response is read after the end of the span.
+                    if phase is not None and not (stream and phase == "response_body"):
+                        span.mark(phase)
+
+                extensions["trace"] = trace
+
+            request = client.build_request(method, url, extensions=extensions, **kwargs)
+            response = client.send(request, stream=stream)
+            if stream and response.status_code != 200:
+                response.read()
+            elif stream:
+                # The request is only done once its body is read by iter_content.
+                self._streams[response] = client
+                client = None
+            return response
+        finally:
+            if client is not None:
+                self._release(client)
+
+    def get(self, url: str, span=NULL_SPAN, stream: bool = False) -> "httpx.Response":
+        """Make a GET request.
+
+        Args:
+            url (str): target URL.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of a successful response is not read, and should be read with iter_content. Defaults to False.
+
+        Returns:
+            httpx.Response: the response of the request.
+        """
+        return self._request("GET", url, span, stream)
+
+    def post(
+        self, url: str, data: dict, span=NULL_SPAN, stream: bool = False
+    ) -> "httpx.Response":
+        """Make a POST request with a JSON body.
+
+        Args:
+            url (str): target URL.
+            data (dict): data of the request.
+            span (Span, optional): span in which the phases of the request are marked. Defaults to NULL_SPAN.
+            stream (bool, optional): If true, the body of a successful response is not read, and should be read with iter_content. Defaults to False.
+
+        Returns:
+            httpx.Response: the response of the request.
+        """
+        return self._request("POST", url, span, stream, json=data)
+
+    def iter_content(
+        self, response: "httpx.Response", chunk_size: int = 65536
+    ) -> Iterator[bytes]:
+        """Iterate over the body of a streamed response, and close it at the end.
+
+        Args:
+            response (httpx.Response): the streamed response.
+            chunk_size (int, optional): maximum size of the chunks, in bytes. Defaults to 65536.
+
+        Yields:
+            bytes: the chunks of the body.
+        """
+        try:
+            yield from response.iter_bytes(chunk_size)
+        finally:
+            response.close()
+            client = self._streams.pop(response, None)
+            if client is not None:
+                self._release(client)
+
+    def close(self) -> None:
+        """Close the connections held by the transport.
+
+        The clients replaced after a change of SSL context are closed as well, even
+        if requests are still in flight through them.
+        """
+        with self._lock:
+            clients = set(self._in_flight)
+            if self.client is not None:
+                clients.add(self.client)
+            self._in_flight.clear()
+            self._streams.clear()
+        for client in clients:
+            client.close()
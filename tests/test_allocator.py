@@ -0,0 +1,78 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of the key allocator and of the slice resolver, on the mock KME.
+"""
+
+import unittest
+
+from etsi_qkd_014_client.allocator import KeyAllocator, KeySliceResolver
+from etsi_qkd_014_client.mock import MockKME
+
+
+class TestAllocator(unittest.TestCase):
+    """
+    Tests of the KeyAllocator and KeySliceResolver classes.
+    """
+
+    def setUp(self) -> None:
+        """Create the mock KME, the allocator and the resolver."""
+        self.kme = MockKME(max_key_size=1024)
+        self.allocator = KeyAllocator(self.kme.client("SAEALICE"), "SAEBOB")
+        self.resolver = KeySliceResolver(self.kme.client("SAEBOB"), "SAEALICE")
+
+    def test_same_slices(self) -> None:
+        """The resolver derives the same sub-keys as the allocator."""
+        for size in (8, 100, 1024, 3, 500, 600):
+            code, master_slice = self.allocator.allocate(size)
+            self.assertEqual(code, 200)
+            code, slave_slice = self.resolver.resolve(
+                master_slice.key_id, master_slice.offset, master_slice.size
+            )
+            self.assertEqual(code, 200)
+            self.assertEqual(master_slice.key, slave_slice.key)
+
+    def test_overlap(self) -> None:
+        """Deriving a portion of a key twice is refused."""
+        _, master_slice = self.allocator.allocate(100)
+        self.resolver.resolve(master_slice.key_id, 0, 100)
+        with self.assertRaises(Exception):
+            self.resolver.resolve(master_slice.key_id, 50, 100)
+
+    def test_bounded_memory(self) -> None:
+        """The resolver forgets the keys whose remaining bits were discarded by the allocator."""
+        key_ids = set()
+        for _ in range(200):
+            _, master_slice = self.allocator.allocate(100)
+            key_ids.add(master_slice.key_id)
+            _, slave_slice = self.resolver.resolve(
+                master_slice.key_id, master_slice.offset, master_slice.size
+            )
+            self.assertEqual(master_slice.key, slave_slice.key)
+            self.assertLessEqual(len(self.resolver._keys), 1)
+            self.assertLessEqual(len(self.resolver._used), 1)
+
+        self.assertEqual(len(key_ids), 20)
+        for key_id in key_ids - {master_slice.key_id}:
+            self.assertEqual(self.resolver.used_portions(key_id), [])
+        # The KME delivers a key only once, so a forgotten key cannot be used again.
+        code, _ = self.resolver.resolve(min(key_ids - {master_slice.key_id}), 1000, 8)
+        self.assertEqual(code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
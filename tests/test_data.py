@@ -0,0 +1,148 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of the incremental parsing of the key container data.
+"""
+
+import json
+import unittest
+
+from etsi_qkd_014_client.data import DataKeyContainer, DataKeyStream
+
+BODY = (
+    '{"keys": [{"key_ID": "bc490419-7d60-487f-adc1-4ddcc177c139", "key": "wHHVxRwDJs3/bXé=="}, '
+    '{"key_ID": "0a782fb5-3434-48fe-aa4d-14f41d46cf92", "key": "OeGMPxh1+2RpJpNCYixWHFLYRubpOKCw94FcIWRlnCE=", '
+    '"key_ID_extension": {"a": [1.5e-3, true, false, null]}}], '
+    '"key_container_extension": {"b": -12.75, "c": "\\u00e9\\ud83d\\ude00\\"", "d": null, "e": 10}}'
+).encode()
+
+
+def parse(chunks: list[bytes]) -> list[tuple]:
+    """Parse a body with a DataKeyStream.
+
+    Args:
+        chunks (list[bytes]): chunks of the body.
+
+    Returns:
+        list[tuple]: the IDs, keys and key ID extensions of the keys, and the key container extension.
+    """
+    stream = DataKeyStream(chunks)
+    keys = [(key.key_id, key.key, key.key_id_extension) for key in stream]
+    return keys + [stream.key_container_extension]
+
+
+class CountingChunks:
+    """
+    Iterator over chunks counting the chunks read.
+    """
+
+    def __init__(self, chunks: list[bytes]) -> None:
+        """Init the iterator.
+
+        Args:
+            chunks (list[bytes]): the chunks.
+        """
+        self.chunks = iter(chunks)
+        self.count = 0
+
+    def __iter__(self) -> "CountingChunks":
+        """Get the iterator.
+
+        Returns:
+            CountingChunks: the iterator.
+        """
+        return self
+
+    def __next__(self) -> bytes:
+        """Get the next chunk.
+
+        Returns:
+            bytes: the chunk.
+        """
+        chunk = next(self.chunks)
+        self.count += 1
+        return chunk
+
+
+class TestDataKeyStream(unittest.TestCase):
+    """
+    Tests of the DataKeyStream class.
+    """
+
+    def setUp(self) -> None:
+        """Parse the body at once with DataKeyContainer."""
+        container = DataKeyContainer(json.loads(BODY))
+        self.expected = [
+            (key.key_id, key.key, key.key_id_extension) for key in container.keys
+        ] + [container.key_container_extension]
+
+    def test_chunk_boundaries(self) -> None:
+        """The keys are the same wherever the body is split."""
+        for split in range(len(BODY) + 1):
+            with self.subTest(split=split):
+                self.assertEqual(parse([BODY[:split], BODY[split:]]), self.expected)
+
+    def test_small_chunks(self) -> None:
+        """The keys are the same when the body is received byte by byte."""
+        chunks = [BODY[i : i + 1] for i in range(len(BODY))]
+        self.assertEqual(parse(chunks), self.expected)
+
+    def test_empty_keys(self) -> None:
+        """An empty array of keys gives no key."""
+        self.assertEqual(parse([b'{"keys": []}']), [None])
+        self.assertEqual(parse([b'{"keys"', b": [", b" ]", b"}"]), [None])
+
+    def test_malformed(self) -> None:
+        """Malformed bodies raise an exception."""
+        for body in (
+            b"",
+            b"[]",
+            b"{}",
+            b'{"key_container_extension": null}',
+            b'{"keys": {}}',
+            b'{"keys": [1]}',
+            b'{"keys": [{"key": "abc"}]}',
+            b'{"keys": [{"key_ID": "a", "key": "b"}}',
+            b'{"keys": [{"key_ID": "a", "key": tru}]}',
+            b'{"keys": [{"key_ID": "a" "key": "b"}]}',
+            b'{"keys": [], "key_container_extension": 1.x}',
+        ):
+            with self.subTest(body=body):
+                with self.assertRaises(Exception):
+                    parse([body])
+
+    def test_truncated(self) -> None:
+        """Truncated bodies raise an exception."""
+        for end in range(len(BODY) - 1):
+            with self.subTest(end=end):
+                with self.assertRaises(Exception):
+                    parse([BODY[:end]])
+
+    def test_malformed_stops_reading(self) -> None:
+        """A malformed key raises without reading the rest of the body."""
+        chunks = CountingChunks(
+            [b'{"keys": [{"key_ID": "a", "key": "b"}, {"key_ID": "a" "key": "b"}']
+            + [b', {"key_ID": "c", "key": "d"}'] * 100
+            + [b"]}"]
+        )
+        with self.assertRaises(Exception):
+            parse(chunks)
+        self.assertEqual(chunks.count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
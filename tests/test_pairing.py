@@ -0,0 +1,78 @@
+# Copyright (C) 2022 Yoann Piétri
+# Copyright (C) 2022 LIP6 - Sorbonne Université
+#
+# etsi-qkd-14-client is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# etsi-qkd-14-client is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with etsi-qkd-14-client. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of the paired sessions, on the mock KME.
+"""
+
+import itertools
+import unittest
+
+from etsi_qkd_014_client.mock import MockKME
+from etsi_qkd_014_client.pairing import MasterSession, SlaveSession
+
+
+class TestPairing(unittest.TestCase):
+    """
+    Tests of the MasterSession and SlaveSession classes.
+    """
+
+    def setUp(self) -> None:
+        """Create the mock KME and the sessions."""
+        self.kme = MockKME(latency=0.005)
+        self.slave = SlaveSession(self.kme.client("SAEBOB"), "SAEALICE", timeout=2)
+        self.master = MasterSession(
+            self.kme.client("SAEALICE"), "SAEBOB", self.slave.feed, batch=2, depth=3
+        )
+
+    def tearDown(self) -> None:
+        """Close the slave session."""
+        self.slave.close()
+
+    def test_same_keys(self) -> None:
+        """Both sessions yield the same keys in the same order."""
+        master_keys = [key.key for key in itertools.islice(self.master, 10)]
+        slave_keys = [key.key for key in itertools.islice(self.slave, 10)]
+        self.assertEqual(master_keys, slave_keys)
+        self.assertEqual(len(set(master_keys)), 10)
+        self.assertGreater(len(self.slave.latencies), 0)
+
+    def test_same_keys_after_close(self) -> None:
+        """Closing the master iterator in the middle of a batch keeps both sides in step."""
+        iterator = iter(self.master)
+        master_keys = [key.key for key in itertools.islice(iterator, 3)]
+        iterator.close()
+        master_keys += [key.key for key in itertools.islice(self.master, 9)]
+
+        slave_keys = [key.key for key in itertools.islice(self.slave, 12)]
+        self.assertEqual(master_keys, slave_keys)
+
+    def test_error(self) -> None:
+        """A failed batch raises on the master side and is skipped by the slave."""
+        master = MasterSession(
+            self.kme.client("SAEALICE"), "SAEBOB", self.slave.feed, size=7, depth=1
+        )
+        with self.assertRaises(Exception):
+            next(iter(master))
+
+        master.size = 256
+        master_keys = [key.key for key in itertools.islice(master, 4)]
+        slave_keys = [key.key for key in itertools.islice(self.slave, 4)]
+        self.assertEqual(master_keys, slave_keys)
+
+
+if __name__ == "__main__":
+    unittest.main()